@@ -0,0 +1,9 @@
+import os
+
+# The benchmarks never reach Ailoo or WooCommerce, but importing the modules
+# loads config/settings.py, which requires these variables.
+for _name in ['BASE_URL', 'ALIOO_USERNAME', 'ALIOO_PASSWORD', 'FACILITY_ID', 'CASH_REGISTER_ID', 'ALIOO_API_KEY']:
+    os.environ.setdefault(_name, 'benchmark')
+os.environ.setdefault('WOOCOMMERCE_URL', 'http://127.0.0.1:8080')
+os.environ.setdefault('WC_CONSUMER_KEY', 'ck_benchmark')
+os.environ.setdefault('WC_CONSUMER_SECRET', 'cs_benchmark')
@@ -0,0 +1,135 @@
+"""
+Synthetic catalogs shaped like the Ailoo product export.
+
+    python -m benchmarks.catalog --rows 10000 --output data/synthetic_catalog.xlsx
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from modules.product import get_product_skus
+from modules.read_excel import EXCEL_COLUMNS
+
+SIZES = ['XS', 'S', 'M', 'L', 'XL', '26', '27.5', '29']
+COLORS = ['Negro', 'Blanco', 'Rojo', 'Azul', 'Verde', 'Gris', 'Amarillo']
+BRANDS = ['Shimano', 'SRAM', 'Trek', 'Specialized', 'Giant', 'Oxford', 'Maxxis', 'Fox']
+WORDS = ['Bicicleta', 'Casco', 'Cadena', 'Pedal', 'Neumático', 'Cámara', 'Guante', 'Luz', 'Bomba', 'Sillín']
+
+
+def generate_catalog(rows, variable_ratio=0.3, variations=(2, 6), categories=20, category_fanout=5,
+                     images=(0, 3), seed=0):
+    """
+    Generate a DataFrame of about rows rows with the columns of the Ailoo export.
+
+    variable_ratio is the share of products with variations, each having a
+    random number of rows in the variations range. Products get a child
+    category out of categories parents with category_fanout children each,
+    and a random number of image paths in the images range.
+    """
+    rng = np.random.default_rng(seed)
+    parents = [f"Categoría {i}" for i in range(categories)]
+
+    records = []
+    product_id = 0
+    while len(records) < rows:
+        product_id += 1
+        parent = parents[rng.integers(categories)]
+        category = f"{parent} / Sub {rng.integers(category_fanout)}"
+        name = f"{WORDS[rng.integers(len(WORDS))]} {BRANDS[rng.integers(len(BRANDS))]} {product_id}"
+        image_paths = ', '.join(
+            f"{rng.integers(1, 50)}/{rng.bytes(8).hex()}.jpg" for _ in range(rng.integers(images[0], images[1] + 1))
+        )
+        product = {
+            'Id': product_id,
+            'Producto': name,
+            'Categoria Primaria': category,
+            'Categoría Padre': parent,
+            'Marca': BRANDS[rng.integers(len(BRANDS))],
+            'Modelo': f"M-{rng.integers(1000)}",
+            'Imagenes Ailoo': image_paths or np.nan,
+            'Descripción': f"Descripción de {name}",
+            'Precio': int(rng.integers(10, 2000)) * 990,
+        }
+
+        if rng.random() < variable_ratio:
+            count = int(rng.integers(variations[0], variations[1] + 1))
+            sizes = rng.permutation(SIZES)[:count]
+            color = COLORS[rng.integers(len(COLORS))]
+            for i, size in enumerate(sizes):
+                records.append(dict(
+                    product, SKU=f"{7800000000000 + product_id * 10 + i}", Tamaños=size, Colores=color,
+                    **{'Stock:Mundo Bikes': int(rng.integers(0, 20))}
+                ))
+        else:
+            records.append(dict(
+                product, SKU=f"{7800000000000 + product_id * 10}",
+                Tamaños=', '.join(rng.permutation(SIZES)[:rng.integers(0, 3)]) or np.nan,
+                Colores=', '.join(rng.permutation(COLORS)[:rng.integers(0, 3)]) or np.nan,
+                **{'Stock:Mundo Bikes': int(rng.integers(0, 20))}
+            ))
+
+    return pd.DataFrame(records[:rows], columns=EXCEL_COLUMNS)
+
+
+def generate_woocommerce_snapshot(df_catalog, existing_ratio=0.8, deleted=0.05, category_ids=None, seed=0):
+    """
+    Generate the WooCommerce snapshot of a catalog already synced in part:
+    existing_ratio of its products exist in WooCommerce, plus deleted times as
+    many products that are no longer in the catalog.
+    """
+    rng = np.random.default_rng(seed)
+    category_ids = category_ids or {}
+    df_products = df_catalog.assign(product_sku=get_product_skus(df_catalog)).drop_duplicates(subset=['product_sku'])
+    df_products = df_products[rng.random(len(df_products)) < existing_ratio]
+    is_variable = df_products['Id'].map(df_catalog['Id'].value_counts()) > 1
+
+    records = [
+        {
+            'id': i + 1,
+            'sku': sku,
+            'type': 'variable' if variable else 'simple',
+            'name': name,
+            'regular_price': str(price),
+            'stock_quantity': None if variable else stock,
+            'categories': [{'id': category_ids.get(category, 0)}],
+            'attributes': [{'name': 'Marca', 'options': [brand]}],
+            'images': [],
+        }
+        for i, (sku, variable, name, price, stock, category, brand) in enumerate(zip(
+            df_products['product_sku'], is_variable, df_products['Producto'], df_products['Precio'],
+            df_products['Stock:Mundo Bikes'], df_products['Categoria Primaria'], df_products['Marca']
+        ))
+    ]
+    for i in range(int(len(records) * deleted)):
+        records.append({
+            'id': len(records) + 1, 'sku': f"deleted-{i}", 'type': 'simple', 'name': f"Eliminado {i}",
+            'regular_price': '1000', 'stock_quantity': 0, 'categories': [], 'attributes': [], 'images': [],
+        })
+    return pd.DataFrame(records)
+
+
+def write_catalog_excel(df_catalog, path):
+    df_catalog.to_excel(path, index=False)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic Ailoo catalog.")
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--variable-ratio', type=float, default=0.3)
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--category-fanout', type=int, default=5)
+    parser.add_argument('--max-images', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='data/synthetic_catalog.xlsx')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    df = generate_catalog(
+        args.rows, variable_ratio=args.variable_ratio, categories=args.categories,
+        category_fanout=args.category_fanout, images=(0, args.max_images), seed=args.seed
+    )
+    write_catalog_excel(df, args.output)
+    print(f"Wrote {len(df)} rows ({df['Id'].nunique()} products) to '{args.output}'.")
@@ -0,0 +1,178 @@
+"""
+End-to-end benchmark: run main.py against the mock services on a synthetic
+catalog, and report the wall time and the requests of every stage, along
+with the stage timers and cache counters of the run's metrics file.
+
+The first run syncs an empty store, the later ones the same catalog, with
+--change-ratio of its prices changed, so --runs 2 measures both the initial
+and the steady-state sync.
+
+    python -m benchmarks.end_to_end --rows 10000 --latency 0.05 --runs 2 --output data/benchmarks/end_to_end.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from modules.local_store import load_json
+from .catalog import generate_catalog, generate_woocommerce_snapshot
+from .mock_server import MockBackend, ROUTES, start_mock_server, catalog_excel_bytes
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def sync_environment(base_url):
+    """
+    Environment pointing every service the sync uses to the mock server.
+    """
+    return dict(
+        os.environ,
+        BASE_URL=f"{base_url}/",
+        AILOO_API_URL=base_url,
+        BASE_IMAGE_URL=base_url,
+        WOOCOMMERCE_URL=base_url,
+        WC_CONSUMER_KEY='ck_benchmark',
+        WC_CONSUMER_SECRET='cs_benchmark',
+        ALIOO_USERNAME='benchmark',
+        ALIOO_PASSWORD='benchmark',
+        ALIOO_API_KEY='benchmark',
+        FACILITY_ID='1',
+        CASH_REGISTER_ID='1',
+    )
+
+
+def run_sync(workdir, env, args):
+    """
+    Run main.py in workdir, where it keeps its data/ and logs/. Returns the
+    wall time and the exit code.
+    """
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, os.path.join(REPO_DIR, 'main.py'), *args], cwd=workdir, env=env)
+    return time.perf_counter() - start, process.returncode
+
+
+def stage_report(backend, started_at):
+    """
+    Requests of each route group, and when they started and ended in seconds
+    since the run started.
+    """
+    report = {}
+    for group, _, _ in ROUTES:
+        stats = backend.stats.get(group)
+        if not stats:
+            continue
+        report[group] = {
+            'requests': stats['requests'],
+            'errors': stats['errors'],
+            'throttled': stats['throttled'],
+            'start': stats['first'] - started_at,
+            'end': stats['last'] - started_at,
+        }
+    return report
+
+
+def print_run(name, run):
+    print(f"\n{name}: {run['seconds']:.2f} s (exit code {run['exit_code']}), {run['sideloaded_images']} images sideloaded")
+    for group, stats in run['stages'].items():
+        print(
+            f"  {group:<22} {stats['requests']:>7} requests  {stats['errors']:>5} errors  "
+            f"{stats['throttled']:>5} throttled  {stats['start']:>8.2f}-{stats['end']:.2f} s"
+        )
+    if run.get('metrics'):
+        for stage, seconds in run['metrics']['stages'].items():
+            print(f"  stage {stage:<16} {seconds:>8.2f} s")
+        for cache, counts in run['metrics']['caches'].items():
+            print(f"  cache {cache:<16} {counts['hits']:>7} hits  {counts['misses']:>5} misses")
+
+
+def change_prices(df_catalog, change_ratio, seed):
+    """
+    Return the catalog with the price of change_ratio of its rows raised, as
+    an export taken after some edits in Ailoo.
+    """
+    rng = np.random.default_rng(seed)
+    df_changed = df_catalog.copy()
+    changed = rng.random(len(df_changed)) < change_ratio
+    df_changed.loc[changed, 'Precio'] = df_changed.loc[changed, 'Precio'] + 990
+    return df_changed
+
+
+def run_benchmark(args):
+    df_catalog = generate_catalog(args.rows, seed=args.seed)
+    backend = MockBackend(
+        catalog_excel_bytes(df_catalog), latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate, retry_after=args.retry_after,
+        image_miss_rate=args.image_miss_rate, seed=args.seed
+    )
+    if args.existing_ratio:
+        df_wc = generate_woocommerce_snapshot(df_catalog, existing_ratio=args.existing_ratio, seed=args.seed)
+        backend.seed_products(df_wc.to_dict('records'))
+
+    server = start_mock_server(backend)
+    env = sync_environment(f"http://127.0.0.1:{server.server_port}")
+    sync_args = ['--force', '--engine', args.engine] + (['--stock-only'] if args.stock_only else [])
+
+    results = {'rows': args.rows, 'engine': args.engine, 'runs': []}
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            os.makedirs(os.path.join(workdir, 'logs'))
+            os.makedirs(os.path.join(workdir, 'data'))
+            for i in range(args.runs):
+                if i and args.change_ratio:
+                    df_catalog = change_prices(df_catalog, args.change_ratio, args.seed + i)
+                    backend.set_excel(catalog_excel_bytes(df_catalog))
+                backend.reset_stats()
+                started_at = time.monotonic()
+                seconds, exit_code = run_sync(workdir, env, sync_args)
+                run = {
+                    'seconds': seconds, 'exit_code': exit_code,
+                    'stages': stage_report(backend, started_at), 'sideloaded_images': backend.sideloads
+                }
+                # The metrics main.py recorded itself: stage timers, client-side latency and cache counters
+                run['metrics'] = load_json(os.path.join(workdir, 'data', 'metrics.json'))
+                results['runs'].append(run)
+                print_run(f"Run {i + 1}", run)
+    finally:
+        server.shutdown()
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark a whole sync against mock services.")
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--runs', type=int, default=2, help="Syncs of the same catalog, one after the other.")
+    parser.add_argument('--engine', choices=['sequential', 'async'], default='sequential')
+    parser.add_argument('--stock-only', action='store_true', help="Run the syncs with --stock-only.")
+    parser.add_argument('--change-ratio', type=float, default=0.0,
+                        help="Share of the catalog rows whose price changes before each run after the first.")
+    parser.add_argument('--existing-ratio', type=float, default=0.0,
+                        help="Share of the catalog already in WooCommerce before the first run.")
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every request.")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Up to this many extra seconds per request.")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of requests answered 500.")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="Share of requests answered 429.")
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--image-miss-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Write the results as JSON.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run_benchmark(args)
+    if args.output:
+        directory = os.path.dirname(args.output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,409 @@
+"""
+Local stand-in for WooCommerce, Ailoo and the Ailoo image host, serving the
+endpoints the sync uses from memory, with configurable latency and faults.
+
+    python -m benchmarks.mock_server --rows 10000 --port 8080 --latency 0.05 --throttle-rate 0.01
+"""
+import argparse
+import hashlib
+import io
+import itertools
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+# Minimal JPEG header, enough for the image probe to recognize an image
+JPEG_BYTES = b'\xff\xd8\xff\xe0\x00\x10JFIF\x00' + b'\x00' * 1024
+
+WC_PREFIX = '/wp-json/wc/v3/'
+
+# Route groups, in the order the sync reaches them: (group, method, path pattern)
+ROUTES = [
+    ('ailoo login', 'GET', re.compile(r'^/InventoryJSON/Login\.rails$')),
+    ('ailoo excel', 'GET', re.compile(r'^/InventoryJSON/DownloadProductsExcel\.rails$')),
+    ('ailoo inventory', 'GET', re.compile(r'^/v1/inventory/all/sku/(?P<sku>[^/]+)$')),
+    ('images', 'GET', re.compile(r'^/Content/products/.+$')),
+    ('wc categories', 'GET', re.compile(r'^/wp-json/wc/v3/products/categories$')),
+    ('wc categories batch', 'POST', re.compile(r'^/wp-json/wc/v3/products/categories/batch$')),
+    ('wc variations', 'GET', re.compile(r'^/wp-json/wc/v3/products/(?P<parent_id>\d+)/variations$')),
+    ('wc variations batch', 'POST', re.compile(r'^/wp-json/wc/v3/products/(?P<parent_id>\d+)/variations/batch$')),
+    ('wc products batch', 'POST', re.compile(r'^/wp-json/wc/v3/products/batch$')),
+    ('wc products', 'GET', re.compile(r'^/wp-json/wc/v3/products$')),
+]
+
+# Groups that never fail on purpose: the sync doesn't retry Ailoo requests and would stop
+RELIABLE_GROUPS = {'ailoo login', 'ailoo excel', 'ailoo inventory'}
+
+
+class MockBackend:
+    """
+    In-memory store of the mock services, plus the request statistics of
+    each route group.
+
+    latency (plus up to jitter) seconds is added to every request. error_rate
+    and throttle_rate are the shares of requests answered 500, and 429 with
+    Retry-After: retry_after. image_miss_rate is the share of image URLs not found.
+    """
+
+    def __init__(self, excel_bytes=b'', latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0,
+                 retry_after=1, image_miss_rate=0.0, seed=0):
+        self.excel_bytes = excel_bytes
+        self.excel_etag = f'"{hashlib.sha1(excel_bytes).hexdigest()}"'
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.image_miss_rate = image_miss_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.products = {}
+        self.variations = defaultdict(dict)
+        self.categories = {}
+        # Media library: {attachment id: src}
+        self.media = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = defaultdict(lambda: {'requests': 0, 'errors': 0, 'throttled': 0, 'first': None, 'last': None})
+            self.sideloads = 0
+
+    def set_excel(self, excel_bytes):
+        self.excel_bytes = excel_bytes
+        self.excel_etag = f'"{hashlib.sha1(excel_bytes).hexdigest()}"'
+
+    def seed_products(self, products):
+        """
+        Load a WooCommerce snapshot, e.g. from generate_woocommerce_snapshot.
+        """
+        with self.lock:
+            for product in products:
+                product = dict(product, id=next(self.ids))
+                self.products[product['id']] = product
+
+    def record(self, group, outcome=None):
+        with self.lock:
+            now = time.monotonic()
+            stats = self.stats[group]
+            stats['requests'] += 1
+            if outcome:
+                stats[outcome] += 1
+            stats['first'] = stats['first'] if stats['first'] is not None else now
+            stats['last'] = now
+
+    def fault(self, group):
+        """
+        Return the status of an injected fault for this request, or None.
+        """
+        if group in RELIABLE_GROUPS:
+            return None
+        with self.lock:
+            draw = self.random.random()
+        if draw < self.throttle_rate:
+            return 429
+        if draw < self.throttle_rate + self.error_rate:
+            return 500
+        return None
+
+    def delay(self):
+        if self.latency or self.jitter:
+            with self.lock:
+                extra = self.random.random() * self.jitter
+            time.sleep(self.latency + extra)
+
+    # WooCommerce
+
+    def _media(self, images):
+        # Like WooCommerce: an id links an existing attachment, a src alone is sideloaded into a new one
+        media = []
+        for image in images or []:
+            if image.get('id'):
+                media.append({'id': image['id'], 'src': self.media.get(image['id'], '')})
+            else:
+                media_id = next(self.ids)
+                self.media[media_id] = f"/wp-content/uploads/{os.path.basename(image['src'])}"
+                self.sideloads += 1
+                media.append({'id': media_id, 'src': self.media[media_id]})
+        return media
+
+    def _write_product(self, data, existing=None):
+        product = dict(existing or {}, **data)
+        if 'images' in data:
+            product['images'] = self._media(data['images'])
+        if 'image' in data:
+            product['image'] = (self._media([data['image']]) or [{}])[0]
+        return product
+
+    def _skus(self):
+        # Like WooCommerce, SKUs are unique across products and variations
+        skus = {product.get('sku'): product_id for product_id, product in self.products.items()}
+        for variations in self.variations.values():
+            skus.update((variation.get('sku'), variation_id) for variation_id, variation in variations.items())
+        skus.pop(None, None)
+        return skus
+
+    def _duplicated_sku(self, sku, skus):
+        return {'id': 0, 'error': {
+            'code': 'product_invalid_sku', 'message': 'Invalid or duplicated SKU.',
+            'data': {'status': 400, 'resource_id': skus[sku], 'unique_sku': f"{sku}-1"}
+        }}
+
+    def products_batch(self, data):
+        response = {}
+        with self.lock:
+            skus = self._skus()
+            for product in data.get('create', []):
+                if product.get('sku') in skus:
+                    response.setdefault('create', []).append(self._duplicated_sku(product['sku'], skus))
+                    continue
+                product = self._write_product(dict(product, id=next(self.ids)))
+                self.products[product['id']] = product
+                skus[product.get('sku')] = product['id']
+                response.setdefault('create', []).append(product)
+            for product in data.get('update', []):
+                if product.get('id') not in self.products:
+                    response.setdefault('update', []).append(
+                        {'id': product.get('id'), 'error': {'code': 'woocommerce_rest_product_invalid_id', 'message': 'Invalid ID.'}}
+                    )
+                    continue
+                self.products[product['id']] = self._write_product(product, self.products[product['id']])
+                response.setdefault('update', []).append(self.products[product['id']])
+            for product_id in data.get('delete', []):
+                product = self.products.pop(product_id, None)
+                self.variations.pop(product_id, None)
+                if product is None:
+                    response.setdefault('delete', []).append(
+                        {'id': product_id, 'error': {'code': 'woocommerce_rest_product_invalid_id', 'message': 'Invalid ID.'}}
+                    )
+                else:
+                    response.setdefault('delete', []).append(product)
+        return response
+
+    def variations_batch(self, parent_id, data):
+        response = {}
+        with self.lock:
+            variations = self.variations[parent_id]
+            skus = self._skus()
+            for variation in data.get('create', []):
+                if variation.get('sku') in skus:
+                    response.setdefault('create', []).append(self._duplicated_sku(variation['sku'], skus))
+                    continue
+                variation = self._write_product(dict(variation, id=next(self.ids)))
+                variations[variation['id']] = variation
+                skus[variation.get('sku')] = variation['id']
+                response.setdefault('create', []).append(variation)
+            for variation in data.get('update', []):
+                variations[variation['id']] = self._write_product(variation, variations.get(variation['id']))
+                response.setdefault('update', []).append(variations[variation['id']])
+            for variation_id in data.get('delete', []):
+                response.setdefault('delete', []).append(variations.pop(variation_id, {'id': variation_id}))
+        return response
+
+    def categories_batch(self, data):
+        response = {'create': []}
+        with self.lock:
+            names = {category['name']: category_id for category_id, category in self.categories.items()}
+            for category in data.get('create', []):
+                if category['name'] in names:
+                    response['create'].append({'id': 0, 'error': {
+                        'code': 'term_exists', 'message': 'A term with the name provided already exists.',
+                        'data': {'status': 400, 'resource_id': names[category['name']]}
+                    }})
+                    continue
+                category = dict(category, id=next(self.ids))
+                self.categories[category['id']] = category
+                names[category['name']] = category['id']
+                response['create'].append(category)
+        return response
+
+
+def paginate(items, query):
+    per_page = int(query.get('per_page', ['10'])[0])
+    page = int(query.get('page', ['1'])[0])
+    total_pages = max(1, math.ceil(len(items) / per_page))
+    headers = {'X-WP-Total': str(len(items)), 'X-WP-TotalPages': str(total_pages)}
+    return items[(page - 1) * per_page:page * per_page], headers
+
+
+def select_fields(items, query):
+    # Top-level fields of _fields, like WordPress does
+    if '_fields' not in query:
+        return items
+    fields = {field.split('.')[0] for field in query['_fields'][0].split(',')}
+    return [{key: value for key, value in item.items() if key in fields} for item in items]
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    backend = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, data, headers=None):
+        self.send_body(status, json.dumps(data).encode('utf-8'), 'application/json', headers)
+
+    def send_body(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def dispatch(self, method):
+        backend = self.backend
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        for group, route_method, pattern in ROUTES:
+            match = pattern.match(url.path)
+            if match and route_method == method:
+                break
+        else:
+            self.send_json(404, {'code': 'rest_no_route', 'message': 'No route was found.'})
+            return
+
+        body = self.read_json() if method == 'POST' else None
+        backend.delay()
+        fault = backend.fault(group)
+        if fault == 429:
+            backend.record(group, 'throttled')
+            self.send_json(429, {'code': 'too_many_requests', 'message': 'Too many requests.'},
+                           {'Retry-After': str(backend.retry_after)})
+            return
+        if fault == 500:
+            backend.record(group, 'errors')
+            self.send_json(500, {'code': 'internal_server_error', 'message': 'Injected error.'})
+            return
+        backend.record(group)
+        getattr(self, 'handle_' + group.replace(' ', '_'))(match, query, body)
+
+    # Ailoo
+
+    def handle_ailoo_login(self, match, query, body):
+        self.send_json(200, {'ailooContext': {'token': 'mock-token'}}, {'Set-Cookie': 'JSESSIONID=mock; Path=/'})
+
+    def handle_ailoo_excel(self, match, query, body):
+        if self.headers.get('If-None-Match') == self.backend.excel_etag:
+            self.send_body(304, b'', 'application/octet-stream', {'ETag': self.backend.excel_etag})
+            return
+        self.send_body(200, self.backend.excel_bytes,
+                       'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                       {'ETag': self.backend.excel_etag})
+
+    def handle_ailoo_inventory(self, match, query, body):
+        product_item_id = int(hashlib.sha1(match['sku'].encode('utf-8')).hexdigest()[:8], 16)
+        self.send_json(200, {'error': {'code': 0}, 'inventoryItems': [{'productItemId': product_item_id}]})
+
+    def handle_images(self, match, query, body):
+        with self.backend.lock:
+            missing = self.backend.random.random() < self.backend.image_miss_rate
+        if missing:
+            self.send_body(404, b'Not found', 'text/plain')
+        else:
+            self.send_body(200, JPEG_BYTES, 'image/jpeg')
+
+    # WooCommerce
+
+    def send_page(self, items, query):
+        page, headers = paginate(items, query)
+        self.send_json(200, select_fields(page, query), headers)
+
+    def handle_wc_products(self, match, query, body):
+        with self.backend.lock:
+            products = sorted(self.backend.products.values(), key=lambda product: product['id'])
+        self.send_page(products, query)
+
+    def handle_wc_products_batch(self, match, query, body):
+        self.send_json(200, self.backend.products_batch(body))
+
+    def handle_wc_variations(self, match, query, body):
+        with self.backend.lock:
+            variations = list(self.backend.variations.get(int(match['parent_id']), {}).values())
+        self.send_page(variations, query)
+
+    def handle_wc_variations_batch(self, match, query, body):
+        self.send_json(200, self.backend.variations_batch(int(match['parent_id']), body))
+
+    def handle_wc_categories(self, match, query, body):
+        with self.backend.lock:
+            categories = sorted(self.backend.categories.values(), key=lambda category: category['id'])
+        if query.get('order', ['asc'])[0] == 'desc':
+            categories.reverse()
+        self.send_page(categories, query)
+
+    def handle_wc_categories_batch(self, match, query, body):
+        self.send_json(200, self.backend.categories_batch(body))
+
+
+def start_mock_server(backend, host='127.0.0.1', port=0):
+    """
+    Serve backend in a background thread. Returns the server; its base URL is
+    f"http://{host}:{server.server_port}".
+    """
+    handler = type('BoundMockHandler', (MockHandler,), {'backend': backend})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def catalog_excel_bytes(df_catalog):
+    buffer = io.BytesIO()
+    df_catalog.to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve mock WooCommerce and Ailoo endpoints.")
+    parser.add_argument('--rows', type=int, default=1000, help="Rows of the synthetic catalog served as the Excel export.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every request.")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Up to this many extra seconds per request.")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of requests answered 500.")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="Share of requests answered 429.")
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--image-miss-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def backend_from_args(args, excel_bytes):
+    return MockBackend(
+        excel_bytes, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate, retry_after=args.retry_after,
+        image_miss_rate=args.image_miss_rate, seed=args.seed
+    )
+
+
+if __name__ == '__main__':
+    from .catalog import generate_catalog
+
+    args = parse_args()
+    server = start_mock_server(backend_from_args(args, catalog_excel_bytes(generate_catalog(args.rows, seed=args.seed))), args.host, args.port)
+    print(f"Mock services listening on http://{args.host}:{server.server_port} (Ctrl+C to stop).")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
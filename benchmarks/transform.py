@@ -0,0 +1,163 @@
+"""
+CPU and memory benchmarks of the transform layer on synthetic catalogs.
+Image probing, Ailoo lookups and WooCommerce reads are stubbed out, so only
+the DataFrame and payload work is measured.
+
+    python -m benchmarks.transform --rows 1000 10000 100000 --output data/benchmarks/transform.json
+    python -m benchmarks.transform --rows 10000 --compare data/benchmarks/transform.json
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+import tracemalloc
+from unittest import mock
+
+import pandas as pd
+
+from modules.product import pre_process_df, identify_products, separate_simple_and_variable, map_sku_to_id
+from modules.product import format_simple_products, format_updated_simple_products
+from modules.product import format_variable_products, format_updated_variable_products
+from modules.dataframe_operations import get_unique_categories, get_row_category_ids
+from modules.image_processing import split_image_paths
+from .catalog import generate_catalog, generate_woocommerce_snapshot
+
+
+def stub_resolve_dataframe_images(df):
+    # Every image is found in its first size variant
+    return pd.Series(
+        [', '.join(f"http://images.local/{path}" for path in split_image_paths(paths)) for paths in df['Imagenes Ailoo']],
+        index=df.index, dtype=object
+    )
+
+
+def stub_get_product_item_ids(skus):
+    return {str(sku): i for i, sku in enumerate(skus, 1)}
+
+
+def stub_get_variations_for_products(wcapi, parent_ids):
+    return {parent_id: [] for parent_id in parent_ids}
+
+
+# Network-bound helpers, as imported by modules.product
+STUBS = {
+    'resolve_dataframe_images': stub_resolve_dataframe_images,
+    'get_product_item_ids': stub_get_product_item_ids,
+    'get_variations_for_products': stub_get_variations_for_products,
+}
+
+
+def prepare(rows, seed=0):
+    """
+    Generate a catalog and its WooCommerce snapshot, and the inputs every case needs.
+    """
+    df_excel = generate_catalog(rows, seed=seed)
+    category_names, row_categories = get_unique_categories(df_excel)
+    category_name_to_id = {name: i for i, name in enumerate(sorted(category_names), 1)}
+    df_wc = generate_woocommerce_snapshot(df_excel, category_ids=category_name_to_id, seed=seed)
+
+    df_new, df_updated, _ = identify_products(pre_process_df(df_excel), df_wc)
+    df_new_simple, df_new_variable = separate_simple_and_variable(df_new)
+    df_updated_simple, df_updated_variable = separate_simple_and_variable(df_updated)
+    return {
+        'df_excel': df_excel,
+        'df_wc': df_wc,
+        'category_name_to_id': category_name_to_id,
+        'row_category_ids': get_row_category_ids(row_categories, category_name_to_id),
+        'sku_to_id': map_sku_to_id(df_wc),
+        'df_new_simple': df_new_simple,
+        'df_new_variable': df_new_variable,
+        'df_updated_simple': df_updated_simple,
+        'df_updated_variable': df_updated_variable,
+    }
+
+
+CASES = {
+    'pre_process_df': lambda d: pre_process_df(d['df_excel']),
+    'identify_products': lambda d: identify_products(d['df_excel'], d['df_wc']),
+    'separate_simple_and_variable': lambda d: separate_simple_and_variable(d['df_excel']),
+    'get_unique_categories': lambda d: get_unique_categories(d['df_excel']),
+    'format_simple_products': lambda d: format_simple_products(d['df_new_simple'], d['row_category_ids']),
+    'format_updated_simple_products': lambda d: format_updated_simple_products(
+        d['df_updated_simple'], d['sku_to_id'], d['row_category_ids']
+    ),
+    'format_variable_products': lambda d: format_variable_products(d['df_new_variable'], d['row_category_ids']),
+    'format_updated_variable_products': lambda d: format_updated_variable_products(
+        d['df_updated_variable'], d['sku_to_id'], d['row_category_ids'], None
+    ),
+}
+
+
+def measure(case, data, repeat):
+    """
+    Return the median seconds of repeat runs, and the peak MiB allocated by one
+    more run under tracemalloc (which slows it down, so it isn't timed).
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        case(data)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    case(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': statistics.median(timings), 'peak_mib': peak / 2 ** 20}
+
+
+def run_benchmarks(sizes, repeat=3, cases=None):
+    results = {}
+    with mock.patch.multiple('modules.product', **STUBS):
+        for rows in sizes:
+            data = prepare(rows)
+            results[str(rows)] = {}
+            for name, case in CASES.items():
+                if cases and name not in cases:
+                    continue
+                results[str(rows)][name] = measure(case, data, repeat)
+                print_result(rows, name, results[str(rows)][name])
+    return results
+
+
+def print_result(rows, name, result, baseline=None):
+    line = f"{rows:>8} rows  {name:<34} {result['seconds'] * 1000:>10.1f} ms  {result['peak_mib']:>8.1f} MiB"
+    if baseline:
+        line += f"  ({result['seconds'] / baseline['seconds']:.2f}x time, {result['peak_mib'] / max(baseline['peak_mib'], 1e-9):.2f}x memory)"
+    print(line)
+
+
+def compare(results, baseline):
+    print("\nCompared with the baseline:")
+    for rows, cases in results.items():
+        for name, result in cases.items():
+            print_result(int(rows), name, result, baseline.get(rows, {}).get(name))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the transform layer on synthetic catalogs.")
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--case', action='append', choices=list(CASES), help="Only run these cases.")
+    parser.add_argument('--output', help="Write the results as JSON, to compare later runs against.")
+    parser.add_argument('--compare', help="JSON results of an earlier run to compare against.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run_benchmarks(args.rows, args.repeat, args.case)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(results, json.load(f))
+    if args.output:
+        directory = os.path.dirname(args.output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,9 @@ from pathlib import Path
 
 from woocommerce import API
 
+from modules.http_session import create_session, use_session_for_woocommerce, ResilientSession, TokenBucket, CircuitBreaker
+from modules.metrics import install_http_metrics
+
 # Ruta al archivo .env
 env_path = Path(__file__).parent.parent / '.env'
 load_dotenv(dotenv_path=env_path)
@@ -26,14 +29,111 @@ PASSWORD = get_env_variable('ALIOO_PASSWORD')
 FACILITY_ID = get_env_variable('FACILITY_ID')
 CASH_REGISTER_ID = get_env_variable('CASH_REGISTER_ID')
 ALIOO_API_KEY = get_env_variable('ALIOO_API_KEY')
+AILOO_API_URL = get_env_variable('AILOO_API_URL', 'https://api.ailoo.cl')
+
+# Reutilización del login de Ailoo (opcionalmente guardado en disco entre ejecuciones)
+AILOO_SESSION_TTL_MINUTES = float(get_env_variable('AILOO_SESSION_TTL_MINUTES', 30))
+AILOO_SESSION_PERSIST = get_env_variable('AILOO_SESSION_PERSIST', 'false').lower() == 'true'
+AILOO_SESSION_PATH = get_env_variable('AILOO_SESSION_PATH', 'data/ailoo_session.json')
+
+# Caché de productItemId de Ailoo por SKU y consultas simultáneas a la API de inventario
+AILOO_ITEM_IDS_PATH = get_env_variable('AILOO_ITEM_IDS_PATH', 'data/ailoo_item_ids.json')
+AILOO_LOOKUP_WORKERS = int(get_env_variable('AILOO_LOOKUP_WORKERS', 8))
+
+# Ruta del archivo Excel descargado de Ailoo
+EXCEL_PATH = get_env_variable('EXCEL_PATH', 'data/raw_excel.xlsx')
+
+# Estado del último archivo Excel procesado (para omitir ejecuciones sin cambios)
+EXCEL_STATE_PATH = get_env_variable('EXCEL_STATE_PATH', 'data/excel_state.json')
+
+# Caché del Excel ya leído (requiere pyarrow)
+EXCEL_CACHE_DIR = get_env_variable('EXCEL_CACHE_DIR', 'data/cache')
+
+# Diario de ejecución (SQLite) para reanudar una sincronización interrumpida con --resume
+RUN_JOURNAL_PATH = get_env_variable('RUN_JOURNAL_PATH', 'data/run_journal.sqlite3')
 
 # Configuración de WooCommerce
 WOOCOMMERCE_URL = get_env_variable('WOOCOMMERCE_URL')
 WC_CONSUMER_KEY = get_env_variable('WC_CONSUMER_KEY')
 WC_CONSUMER_SECRET = get_env_variable('WC_CONSUMER_SECRET')
 
+# Cantidad máxima de productos por llamada a 'products/batch' (límite de WooCommerce: 100)
+WC_BATCH_SIZE = int(get_env_variable('WC_BATCH_SIZE', 100))
+
+# Peticiones simultáneas a WooCommerce al leer colecciones paginadas
+WC_MAX_WORKERS = int(get_env_variable('WC_MAX_WORKERS', 4))
+WC_TIMEOUT = int(get_env_variable('WC_TIMEOUT', 60))
+# Timeout de las escrituras en lote: WordPress sube las imágenes de todo el lote en la misma petición
+WC_BATCH_TIMEOUT = int(get_env_variable('WC_BATCH_TIMEOUT', 300))
+
+# Límite de peticiones a WooCommerce (se reduce ante respuestas 429), reintentos y corte de circuito
+WC_RATE_LIMIT = float(get_env_variable('WC_RATE_LIMIT', 10))
+WC_RATE_LIMIT_MIN = float(get_env_variable('WC_RATE_LIMIT_MIN', 0.5))
+WC_MAX_RETRIES = int(get_env_variable('WC_MAX_RETRIES', 4))
+WC_BACKOFF_BASE = float(get_env_variable('WC_BACKOFF_BASE', 1))
+WC_BACKOFF_MAX = float(get_env_variable('WC_BACKOFF_MAX', 30))
+WC_CIRCUIT_FAILURES = int(get_env_variable('WC_CIRCUIT_FAILURES', 5))
+WC_CIRCUIT_RESET_SECONDS = float(get_env_variable('WC_CIRCUIT_RESET_SECONDS', 60))
+
+# Índice local de categorías de WooCommerce (nombre -> ID)
+CATEGORY_INDEX_PATH = get_env_variable('CATEGORY_INDEX_PATH', 'data/category_index.json')
+CATEGORY_INDEX_TTL_HOURS = float(get_env_variable('CATEGORY_INDEX_TTL_HOURS', 24))
+
+# Estado local de lo último escrito en WooCommerce por SKU, y cada cuánto se reconcilia con el catálogo completo
+PRODUCT_STATE_PATH = get_env_variable('PRODUCT_STATE_PATH', 'data/product_state.json')
+PRODUCT_STATE_RECONCILE_HOURS = float(get_env_variable('PRODUCT_STATE_RECONCILE_HOURS', 24))
+
+# Índice de imágenes ya subidas a la biblioteca de medios de WooCommerce
+MEDIA_INDEX_PATH = get_env_variable('MEDIA_INDEX_PATH', 'data/media_index.json')
+
+# Lotes ya formateados que pueden esperar a ser escritos en WooCommerce
+PIPELINE_MAX_PENDING_BATCHES = int(get_env_variable('PIPELINE_MAX_PENDING_BATCHES', 4))
+
+# Motor asíncrono (--engine async): etapas de formateo simultáneas
+ASYNC_FORMAT_CONCURRENCY = int(get_env_variable('ASYNC_FORMAT_CONCURRENCY', 1))
+
 # URL base de las imágenes
-BASE_IMAGE_URL='http://mundobikes.ailoo.cl'
+BASE_IMAGE_URL = get_env_variable('BASE_IMAGE_URL', 'http://mundobikes.ailoo.cl')
+
+# Caché de imágenes resueltas (las imágenes no encontradas se vuelven a verificar antes)
+IMAGE_CACHE_PATH = get_env_variable('IMAGE_CACHE_PATH', 'data/image_cache.json')
+IMAGE_CACHE_TTL_HOURS = float(get_env_variable('IMAGE_CACHE_TTL_HOURS', 168))
+IMAGE_CACHE_MISS_TTL_HOURS = float(get_env_variable('IMAGE_CACHE_MISS_TTL_HOURS', 24))
+
+# Verificación concurrente de imágenes
+IMAGE_PROBE_WORKERS = int(get_env_variable('IMAGE_PROBE_WORKERS', 16))
+IMAGE_PROBE_MAX_PER_HOST = int(get_env_variable('IMAGE_PROBE_MAX_PER_HOST', 8))
+IMAGE_PROBE_TIMEOUT = float(get_env_variable('IMAGE_PROBE_TIMEOUT', 5))
+
+# Timeout por defecto de las peticiones a Ailoo
+HTTP_TIMEOUT = float(get_env_variable('HTTP_TIMEOUT', 30))
+
+# Métricas de cada ejecución: JSON, textfile de Prometheus e historial (vacío para desactivar)
+METRICS_PATH = get_env_variable('METRICS_PATH', 'data/metrics.json')
+METRICS_TEXTFILE_PATH = get_env_variable('METRICS_TEXTFILE_PATH', 'data/metrics.prom')
+METRICS_HISTORY_PATH = get_env_variable('METRICS_HISTORY_PATH', 'data/metrics_history.jsonl')
+
+# Sesiones HTTP compartidas (keep-alive), con un pool de conexiones por host
+# del tamaño de la concurrencia configurada para cada servicio
+ailoo_session = create_session(pool_maxsize=2, timeout=HTTP_TIMEOUT)
+ailoo_api_session = create_session(pool_maxsize=AILOO_LOOKUP_WORKERS, timeout=HTTP_TIMEOUT)
+image_session = create_session(pool_maxsize=IMAGE_PROBE_MAX_PER_HOST, timeout=IMAGE_PROBE_TIMEOUT)
+wc_session = create_session(pool_maxsize=WC_MAX_WORKERS, timeout=WC_TIMEOUT, session=ResilientSession(
+    rate_limiter=TokenBucket(max_rate=WC_RATE_LIMIT, min_rate=WC_RATE_LIMIT_MIN, burst=WC_MAX_WORKERS),
+    circuit_breaker=CircuitBreaker(failure_threshold=WC_CIRCUIT_FAILURES, reset_timeout=WC_CIRCUIT_RESET_SECONDS),
+    max_retries=WC_MAX_RETRIES,
+    backoff_base=WC_BACKOFF_BASE,
+    backoff_max=WC_BACKOFF_MAX,
+    max_concurrency=WC_MAX_WORKERS,
+    batch_timeout=WC_BATCH_TIMEOUT
+))
+
+# Contar las peticiones de cada sesión; las rutas de la API de inventario y de
+# las imágenes se acortan para no tener una serie por SKU o por imagen
+install_http_metrics(ailoo_session)
+install_http_metrics(ailoo_api_session, max_path_segments=4)
+install_http_metrics(image_session, max_path_segments=2)
+install_http_metrics(wc_session)
 
 # Configuración de la API de WooCommerce
 
@@ -42,5 +142,6 @@ wcapi = API(
     consumer_key=WC_CONSUMER_KEY,
     consumer_secret=WC_CONSUMER_SECRET,
     version="wc/v3",
-    timeout=60
-)
\ No newline at end of file
+    timeout=WC_TIMEOUT
+)
+use_session_for_woocommerce(wc_session)
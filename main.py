@@ -1,15 +1,21 @@
 # main.py
 
+import argparse
+import asyncio
 import logging
 
-from config.settings import wcapi
+from config.settings import EXCEL_PATH, METRICS_PATH, METRICS_TEXTFILE_PATH, METRICS_HISTORY_PATH
 
-from modules.alioo.excel_download import download_excel
-from modules.read_excel import read_excel
-from modules.woocommerce_api import get_all_woocommerce_products
-from modules.product import pre_process_df, identify_products, separate_simple_and_variable, format_simple_products, format_updated_simple_products, map_sku_to_id
-from modules.woocommerce_api import create_simple_products, update_products, delete_products_batch, get_all_woocommerce_categories, create_missing_categories
-from modules.dataframe_operations import get_unique_categories
+from modules.sync_stages import download_stage, read_excel_stage, snapshot_stage, plan_writes, record_writes, delete_stage, finish_run
+from modules.image_cache import invalidate_image_cache, save_image_cache
+from modules.alioo.alioo_inventory import save_product_item_ids
+from modules.product_state import save_product_state
+from modules.media_index import save_media_index
+from modules.async_engine import run_async
+from modules.pipeline import stream_products
+from modules.run_journal import RunJournal
+from modules.stock_sync import run_stock_sync
+from modules.metrics import stage_timer, write_metrics
 
 # Configuración del logging
 logging.basicConfig(
@@ -18,92 +24,88 @@ logging.basicConfig(
     format='%(asctime)s %(levelname)s:%(message)s'
 )
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Sync Ailoo products into WooCommerce.")
+    parser.add_argument('--invalidate-image-cache', action='store_true',
+                        help="Forget every resolved image URL and probe all images again.")
+    parser.add_argument('--force', action='store_true',
+                        help="Sync even if the Excel file didn't change since the last successful run.")
+    parser.add_argument('--resume', action='store_true',
+                        help="Continue the last interrupted or partially written run from its journal instead of starting over.")
+    parser.add_argument('--reconcile', action='store_true',
+                        help="Diff against the full WooCommerce catalog instead of the local product state.")
+    parser.add_argument('--stock-only', action='store_true',
+                        help="Only push price and stock changes, diffing against the local product state.")
+    parser.add_argument('--engine', choices=['sequential', 'async'], default='sequential',
+                        help="Run the stages one after another, or overlap them with the asyncio engine.")
+    return parser.parse_args(argv)
+
+def run_sequential(excel_path, force=False, resume=False, reconcile=False):
+    """
+    Run every stage of the sync one after another. Each stage's output and
+    each confirmed write are recorded in the run journal, so with resume an
+    interrupted run continues where it stopped. Unless reconciling, products
+    are diffed against the local product state instead of WooCommerce.
+    """
+    journal = RunJournal(resume=resume)
+
+    excel_changed, excel_state = download_stage(journal, excel_path, force)
+    if not excel_changed:
+        logging.info("Excel file unchanged since the last successful run, nothing to sync.")
+        journal.finish('skipped')
+        return
+
+    df_excel = read_excel_stage(excel_path)
+    df_wc = snapshot_stage(journal, reconcile)
+    stages, delete_ids = plan_writes(journal, df_excel, df_wc)
+
+    # Products are formatted and written batch by batch: each batch is sent while the next one is formatted
+    results = {}
+    for stage, df, format_chunk, write_batch in stages:
+        with stage_timer(stage):
+            sent, written = stream_products(df, format_chunk, write_batch, on_written=lambda written: record_writes(journal, stage, written))
+        logging.info(f"{stage}: wrote {len(written)} of {sent} products.")
+        results[stage] = (sent, len(written))
+
+    if delete_ids:
+        results['delete'] = (len(delete_ids), len(delete_stage(journal, delete_ids)))
+
+    finish_run(journal, excel_state, results)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    status = 'failed'
     try:
         # Clear log file
         open('logs/app.log', 'w').close()
 
         logging.info("Starting process...")
 
-        # File paths
-        excel_path = 'data/raw_excel.xlsx'
+        if args.invalidate_image_cache:
+            invalidate_image_cache()
 
-        # Download the Excel file
-        download_excel(excel_path)
-
-        # Read the Excel file
-        df_excel = read_excel(excel_path)
-
-        # Get all WooCommerce products
-        df_wc = get_all_woocommerce_products(wcapi)
-
-        # Read WooCommerce products
-        df_excel = pre_process_df(df_excel)
-
-        # # Identify new, updated, and deleted products
-        df_new, df_updated, df_delete = identify_products(df_excel, df_wc)
-
-        # Extract unique categories from Excel
-        category_names = get_unique_categories(df_excel)
-
-        # Get existing categories from WooCommerce
-        category_name_to_id = get_all_woocommerce_categories(wcapi)
-
-        # Create missing categories
-        category_name_to_id = create_missing_categories(wcapi, category_names, category_name_to_id)
-
-        if not df_new.empty:
-            logging.info(f"Found {len(df_new)} new products.")
-            # # Separate simple and variable products
-            df_new_simple, df_new_variable = separate_simple_and_variable(df_new)
-
-            # Export df_new_simple to a new Excel file
-            df_new_simple.to_excel('data/new_simple_products.xlsx', index=False)
-
-            # Format and create new products
-            new_simple_products = format_simple_products(df_new_simple, category_name_to_id)
-
-            # Create new products in WooCommerce
-            create_simple_products(wcapi, new_simple_products)
-        else:
-            logging.info("No products to create.")
-
-        # If there are products to update in WooCommerce (df_updated is not empty)
-        if not df_updated.empty:
-            logging.info(f"Found {len(df_updated)} products to update.")
-            # Map SKU to WooCommerce ID
-            sku_to_id = map_sku_to_id(df_wc)
-
-            # Process updated products
-            df_updated_simple, df_updated_variable = separate_simple_and_variable(df_updated)
-
-            # Format products
-            updated_simple_products = format_updated_simple_products(df_updated_simple, sku_to_id, category_name_to_id)
-
-            # Update products in WooCommerce
-            update_products(wcapi, updated_simple_products)
-
-            logging.info("Products updated.")
-        else:
-            logging.info("No products to update.")
-
-        if not df_delete.empty:
-            logging.info(f"Found {len(df_delete)} products to delete.")
-
-            # Delete products in WooCommerce that are not in the Excel file
-            product_ids_to_delete = df_delete['id'].tolist()
-
-            delete_products_batch(wcapi, product_ids_to_delete)
-
-            logging.info("Products deleted.")
+        if args.stock_only:
+            run_stock_sync(EXCEL_PATH, args.force)
+        elif args.engine == 'async':
+            asyncio.run(run_async(EXCEL_PATH, args.force, args.resume, args.reconcile))
         else:
-            logging.info("No products to delete.")
+            run_sequential(EXCEL_PATH, args.force, args.resume, args.reconcile)
 
         logging.info("Process finished successfully.")
+        status = 'success'
 
     except Exception as e:
         logging.error(f"An error occurred during the process: {e}")
         raise
+    finally:
+        # Keep the images, Ailoo IDs, product writes and media IDs recorded so far, even if the run failed
+        save_image_cache()
+        save_product_item_ids()
+        save_product_state()
+        save_media_index()
+        # Keep the metrics of every run, failed ones included, to compare them across runs
+        write_metrics(status, METRICS_PATH, METRICS_TEXTFILE_PATH, METRICS_HISTORY_PATH)
 
 if __name__ == "__main__":
     main()
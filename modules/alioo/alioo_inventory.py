@@ -1,16 +1,33 @@
 import requests
-from config.settings import ALIOO_API_KEY
+from concurrent.futures import ThreadPoolExecutor
+from config.settings import ALIOO_API_KEY, AILOO_API_URL, AILOO_ITEM_IDS_PATH, AILOO_LOOKUP_WORKERS, ailoo_api_session
+from ..local_store import load_json, save_json
+from ..metrics import record_cache
 import logging
 
-def get_product_item_id(sku):
+# productItemId by SKU. Ailoo never changes the ID of an existing SKU, so
+# found IDs are persisted between runs; SKUs not found are only remembered
+# for the current run.
+_product_item_ids = None
+_missing_skus = set()
+
+
+def _get_product_item_ids():
+    global _product_item_ids
+    if _product_item_ids is None:
+        _product_item_ids = load_json(AILOO_ITEM_IDS_PATH, {})
+    return _product_item_ids
+
+
+def fetch_product_item_id(sku):
     logging.info(f"Buscando product item id para sku: {sku}")
-    url = f"https://api.ailoo.cl/v1/inventory/all/sku/{sku}"
+    url = f"{AILOO_API_URL}/v1/inventory/all/sku/{sku}"
     headers = {
         "X-Ailoo-Access-Token": ALIOO_API_KEY
     }
 
     try:
-        response = requests.get(url, headers=headers)
+        response = ailoo_api_session.get(url, headers=headers)
         response.raise_for_status()
         data = response.json()
 
@@ -28,4 +45,32 @@ def get_product_item_id(sku):
 
     except requests.exceptions.RequestException as e:
         logging.error(f"Error al buscar product item id para sku: {sku}")
-        raise
\ No newline at end of file
+        raise
+
+
+def get_product_item_ids(skus):
+    """
+    Return {sku: productItemId} for many SKUs, with None for SKUs not found in
+    Ailoo. Only SKUs not resolved before are looked up, concurrently.
+    """
+    product_item_ids = _get_product_item_ids()
+    skus = [str(sku) for sku in dict.fromkeys(skus)]
+    pending_skus = [sku for sku in skus if sku not in product_item_ids and sku not in _missing_skus]
+    record_cache('ailoo_item_id', hits=len(skus) - len(pending_skus), misses=len(pending_skus))
+
+    if pending_skus:
+        logging.info(f"Buscando product item id para {len(pending_skus)} SKUs sin caché...")
+        with ThreadPoolExecutor(max_workers=AILOO_LOOKUP_WORKERS) as executor:
+            for sku, product_item_id in zip(pending_skus, executor.map(fetch_product_item_id, pending_skus)):
+                if product_item_id is None:
+                    _missing_skus.add(sku)
+                else:
+                    product_item_ids[sku] = product_item_id
+
+    return {sku: product_item_ids.get(sku) for sku in skus}
+
+
+def save_product_item_ids():
+    if _product_item_ids is not None:
+        save_json(AILOO_ITEM_IDS_PATH, _product_item_ids)
+        logging.info(f"Saved {len(_product_item_ids)} Ailoo product item ids to '{AILOO_ITEM_IDS_PATH}'.")
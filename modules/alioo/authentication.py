@@ -1,8 +1,16 @@
 # modules/authentication/login.py
 
-import requests
+import logging
+import os
+import time
 from urllib.parse import urljoin
-from config.settings import BASE_URL, USERNAME, PASSWORD, FACILITY_ID, CASH_REGISTER_ID
+from config.settings import BASE_URL, USERNAME, PASSWORD, FACILITY_ID, CASH_REGISTER_ID, ailoo_session
+from config.settings import AILOO_SESSION_TTL_MINUTES, AILOO_SESSION_PERSIST, AILOO_SESSION_PATH
+from ..local_store import load_json, save_json
+from ..metrics import record_cache
+
+# Current login: {"token": str, "cookies": dict, "expires_at": float}
+_credentials = None
 
 def login():
     """
@@ -18,29 +26,88 @@ def login():
         "cashRegisterId": CASH_REGISTER_ID
     }
 
-    # Create a session to persist the cookies
-    session = requests.Session()
-    response = session.get(login_url, params=params)
+    # The shared Ailoo session keeps the connection and persists the cookies
+    response = ailoo_session.get(login_url, params=params)
     response.raise_for_status()  #  Raise an exception for 4xx and 5xx status codes
 
     data = response.json()
     token = data['ailooContext']['token']
 
     # Get the cookies from the session
-    cookies = session.cookies.get_dict()
+    cookies = ailoo_session.cookies.get_dict()
+
+    return token, cookies
+
+def get_credentials(force_refresh=False):
+    """
+    Return the token and cookies of the current login, logging in only when
+    there is no login yet or it has expired.
+    """
+    global _credentials
+    if not force_refresh:
+        if _credentials is None and AILOO_SESSION_PERSIST:
+            _credentials = load_json(AILOO_SESSION_PATH)
+        if _credentials and _credentials['expires_at'] > time.time():
+            record_cache('ailoo_login', hits=1)
+            return _credentials['token'], _credentials['cookies']
 
+    logging.info("Iniciando sesión en Ailoo...")
+    record_cache('ailoo_login', misses=1)
+    token, cookies = login()
+    _credentials = {
+        "token": token,
+        "cookies": cookies,
+        "expires_at": time.time() + AILOO_SESSION_TTL_MINUTES * 60
+    }
+    if AILOO_SESSION_PERSIST:
+        save_json(AILOO_SESSION_PATH, _credentials)
     return token, cookies
 
+def invalidate_credentials():
+    """
+    Forget the current login, so the next request logs in again.
+    """
+    global _credentials
+    _credentials = None
+    if AILOO_SESSION_PERSIST and os.path.exists(AILOO_SESSION_PATH):
+        os.remove(AILOO_SESSION_PATH)
+
 def get_token():
     """
     Return the authentication token for future requests.
     """
-    token, _ = login()
+    token, _ = get_credentials()
     return token
 
 def get_cookies():
     """
     Return the session cookies for future requests.
     """
-    _, cookies = login()
+    _, cookies = get_credentials()
     return cookies
+
+def authenticated_get(url, params=None, **kwargs):
+    """
+    Send a GET request with the login cookies. If Ailoo answers 401 the login
+    is refreshed and the request sent once more.
+    """
+    for attempt in range(2):
+        token, cookies = get_credentials(force_refresh=attempt > 0)
+
+        # Add the cookies obtained in the login
+        session_cookies = {
+            'token': token,
+            'user': USERNAME,
+            'facility': FACILITY_ID,
+            'cashRegister': CASH_REGISTER_ID
+        }
+        session_cookies.update(cookies)
+
+        response = ailoo_session.get(url, params=params, cookies=session_cookies, **kwargs)
+        if response.status_code != 401:
+            return response
+
+        logging.info("La sesión de Ailoo expiró, iniciando sesión nuevamente...")
+        response.close()
+        invalidate_credentials()
+    return response
@@ -1,30 +1,68 @@
 # modules/excel_download/download_excel.py
 
+import hashlib
 import logging
-import requests
+import os
+import zipfile
 from urllib.parse import urljoin
 from datetime import datetime
-from config.settings import BASE_URL, USERNAME, FACILITY_ID, CASH_REGISTER_ID
-from .authentication import get_cookies, get_token
+from config.settings import BASE_URL, EXCEL_STATE_PATH
+from .authentication import authenticated_get
+from ..local_store import load_json, save_json
+from ..metrics import record_cache
+
+# Size of the chunks written to disk while downloading
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def excel_content_hash(path):
+    """
+    Hash the contents of an .xlsx file. The document properties are left out,
+    since they hold the generation date and change on every export.
+    """
+    digest = hashlib.sha256()
+    try:
+        with zipfile.ZipFile(path) as workbook:
+            for name in sorted(workbook.namelist()):
+                if name.startswith('docProps/'):
+                    continue
+                digest.update(name.encode('utf-8'))
+                digest.update(workbook.read(name))
+    except zipfile.BadZipFile:
+        # Not an .xlsx file, hash the raw bytes
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_excel_state():
+    return load_json(EXCEL_STATE_PATH, {})
+
+
+def save_excel_state(state):
+    """
+    Remember the downloaded Excel as processed. Call it only after a
+    successful run, so a failed run is retried even if the file is unchanged.
+    """
+    save_json(EXCEL_STATE_PATH, state)
 
 
 def download_excel(output_path):
     # """
     # Download the Excel file with the products from the Alioo system.
+    # Returns (changed, state): whether the content differs from the last
+    # processed file, and the state to pass to save_excel_state.
     # """
-    # Get the authentication token and session cookies
-    token = get_token()
-    cookies = get_cookies()
-
-    # Add the cookies obtained in the login
-    session_cookies = {
-        'token': token,
-        'user': USERNAME,
-        'facility': FACILITY_ID,
-        'cashRegister': CASH_REGISTER_ID
-    }
-    # Update the session cookies with the cookies from the login
-    session_cookies.update(cookies)
+    previous_state = load_excel_state()
+
+    # Ask Ailoo to skip the download if the file didn't change, when it supports it
+    headers = {}
+    if os.path.exists(output_path):
+        if previous_state.get('etag'):
+            headers['If-None-Match'] = previous_state['etag']
+        if previous_state.get('last_modified'):
+            headers['If-Modified-Since'] = previous_state['last_modified']
 
     logging.info("Descargando archivo Excel...")
 
@@ -37,15 +75,31 @@ def download_excel(output_path):
         "until": datetime.now().strftime('%Y-%m-%d')  # Current date
     }
 
-    # Send the request to download the Excel
-    response = requests.get(download_url, params=params, cookies=session_cookies)
-    response.raise_for_status()
-
-    logging.info("Archivo Excel descargado correctamente.")
-
-    # Save the Excel file
-    with open(output_path, 'wb') as f:
-        f.write(response.content)
+    # Send the request to download the Excel, logging in only if needed
+    response = authenticated_get(download_url, params=params, headers=headers, stream=True)
+    with response:
+        if response.status_code == 304:
+            logging.info("El archivo Excel no cambió desde la última ejecución.")
+            record_cache('excel_download', hits=1)
+            return False, previous_state
+        response.raise_for_status()
+        record_cache('excel_download', misses=1)
 
+        # Stream the Excel file to disk
+        tmp_path = f"{output_path}.part"
+        with open(tmp_path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                f.write(chunk)
+        os.replace(tmp_path, output_path)
 
     logging.info(f"Archivo Excel guardado en '{output_path}'.")
+
+    state = {
+        "sha256": excel_content_hash(output_path),
+        "etag": response.headers.get('ETag'),
+        "last_modified": response.headers.get('Last-Modified')
+    }
+    changed = state['sha256'] != previous_state.get('sha256')
+    if not changed:
+        logging.info("El contenido del archivo Excel no cambió desde la última ejecución.")
+    return changed, state
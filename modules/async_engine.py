@@ -0,0 +1,102 @@
+import asyncio
+import logging
+
+from config.settings import WC_MAX_WORKERS, WC_BATCH_SIZE, ASYNC_FORMAT_CONCURRENCY, PIPELINE_MAX_PENDING_BATCHES
+from .pipeline import iter_chunks
+from .run_journal import RunJournal
+from .metrics import stage_timer
+from .sync_stages import download_stage, read_excel_stage, snapshot_stage, plan_writes, record_writes, delete_stage, finish_run
+
+
+async def run_in_thread(semaphore, func, *args):
+    """
+    Run a blocking function in a worker thread, holding a slot of semaphore.
+    """
+    async with semaphore:
+        return await asyncio.to_thread(func, *args)
+
+
+async def run_pipeline(name, chunks, format_chunk, write_batch, limits, on_written=None):
+    """
+    Format the chunks one after another and write each batch as soon as it is
+    ready, while the following chunks are still being formatted. At most
+    PIPELINE_MAX_PENDING_BATCHES formatted batches wait for a writer.
+    on_written is called with the results of each batch. Returns the number
+    of payloads sent and of products written.
+    """
+    queue = asyncio.Queue(maxsize=PIPELINE_MAX_PENDING_BATCHES)
+    sent = 0
+    written_count = 0
+
+    async def produce():
+        for chunk in chunks:
+            payloads = await run_in_thread(limits['format'], format_chunk, chunk)
+            if payloads:
+                await queue.put(payloads)
+        for _ in range(WC_MAX_WORKERS):
+            await queue.put(None)
+
+    async def consume():
+        nonlocal sent, written_count
+        while (payloads := await queue.get()) is not None:
+            written = await run_in_thread(limits['woocommerce'], write_batch, payloads)
+            if on_written:
+                on_written(written)
+            sent += len(payloads)
+            written_count += len(written)
+
+    with stage_timer(name):
+        await asyncio.gather(produce(), *(consume() for _ in range(WC_MAX_WORKERS)))
+    logging.info(f"[async] {name}: wrote {written_count} of {sent} products.")
+    return sent, written_count
+
+
+async def run_async(excel_path, force=False, resume=False, reconcile=False):
+    """
+    Run the sync overlapping its stages. Once the download says the Excel file
+    changed, it is read together with the WooCommerce snapshot, and products
+    are written in batches while the next ones are formatted. Concurrency is
+    bounded per upstream: WC_MAX_WORKERS WooCommerce stages at a time, whose
+    requests, nested page and variation fetches included, share the
+    WC_MAX_WORKERS slots of wc_session; and ASYNC_FORMAT_CONCURRENCY
+    formatting stages, each of which keeps the image host and Ailoo API
+    limits of its own worker pools.
+    Like the sequential engine, it records its progress in the run journal.
+    """
+    journal = RunJournal(resume=resume)
+    limits = {
+        'ailoo': asyncio.Semaphore(1),
+        'woocommerce': asyncio.Semaphore(WC_MAX_WORKERS),
+        'format': asyncio.Semaphore(ASYNC_FORMAT_CONCURRENCY),
+    }
+
+    excel_changed, excel_state = await run_in_thread(limits['ailoo'], download_stage, journal, excel_path, force)
+    if not excel_changed:
+        logging.info("Excel file unchanged since the last successful run, nothing to sync.")
+        journal.finish('skipped')
+        return
+
+    # Read the Excel file while fetching the WooCommerce products
+    df_excel, df_wc = await asyncio.gather(
+        asyncio.to_thread(read_excel_stage, excel_path),
+        run_in_thread(limits['woocommerce'], snapshot_stage, journal, reconcile),
+    )
+    stages, delete_ids = await run_in_thread(limits['woocommerce'], plan_writes, journal, df_excel, df_wc)
+
+    async def delete_products():
+        deleted_ids = await run_in_thread(limits['woocommerce'], delete_stage, journal, delete_ids)
+        return len(delete_ids), len(deleted_ids)
+
+    pipelines = {
+        stage: run_pipeline(
+            stage, iter_chunks(df, WC_BATCH_SIZE), format_chunk, write_batch, limits,
+            on_written=lambda written, stage=stage: record_writes(journal, stage, written)
+        )
+        for stage, df, format_chunk, write_batch in stages
+    }
+    if delete_ids:
+        pipelines['delete'] = delete_products()
+
+    results = dict(zip(pipelines, await asyncio.gather(*pipelines.values())))
+
+    finish_run(journal, excel_state, results)
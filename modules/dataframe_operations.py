@@ -1,29 +1,63 @@
-def get_unique_categories(df):
-    categories = set()
-    for index, row in df.iterrows():
-        row_categories = set()
+import pandas as pd
 
-        # Collect 'Categoria Primaria' and 'Categoría Padre'
-        primary_category = str(row['Categoria Primaria']).strip()
-        parent_category = str(row['Categoría Padre']).strip()
+# Category columns, in the order their IDs are sent to WooCommerce
+CATEGORY_COLUMNS = ['Categoria Primaria', 'Categoría Padre']
 
-        split_primary_category = primary_category.split(',')
-        split_parent_category = parent_category.split(',')
 
-        # Save the split strings to a new
-        row_categories.update(split_primary_category)
-        row_categories.update(split_parent_category)
+def split_category_column(df, column):
+    """
+    Return the category names of one column, one per entry, indexed by the row
+    they come from. Comma-separated cells are split into several names.
+    """
+    if column not in df.columns or df.empty:
+        return pd.Series([], dtype=object)
+    names = df[column].dropna().astype(str).str.split(',').explode().str.strip()
 
-        # Remove duplicates and empty strings
-        row_categories = set(filter(None, row_categories))
+    # Remove empty strings and nan strings
+    return names[(names != '') & (names != 'nan')]
 
-        # Remove nan strings from the set
-        row_categories.discard('nan')
 
-        # Add the row categories to the set of all categories
-        categories.update(row_categories)
+def explode_categories(df):
+    """
+    Return every category name of the DataFrame, one per entry, indexed by the
+    row it comes from.
+    """
+    return pd.concat([split_category_column(df, column) for column in CATEGORY_COLUMNS])
 
-        # Add the row categories to the dataframe row itself
-        df.at[index, 'categories'] = row_categories
 
-    return categories
\ No newline at end of file
+def get_unique_categories(df):
+    """
+    Return the set of category names in the DataFrame, and a Series mapping
+    each row with categories to the tuple of its category names.
+    """
+    names = explode_categories(df)
+    categories = set(names)
+    row_categories = names.groupby(level=0, sort=False).agg(lambda row_names: tuple(dict.fromkeys(row_names)))
+    return categories, row_categories
+
+
+def get_row_category_ids(row_categories, category_name_to_id):
+    """
+    Turn the row_categories of get_unique_categories into the WooCommerce
+    category IDs of each row: {row index: [id]}. Names without an ID are
+    skipped. Rows keep their index through the filters and chunks of the
+    pipeline, so the formatters look their rows up here.
+    """
+    return {
+        index: list(dict.fromkeys(category_name_to_id[name] for name in names if name in category_name_to_id))
+        for index, names in row_categories.items()
+    }
+
+
+def get_category_parents(df):
+    """
+    Return {category name: parent name}, pairing each 'Categoria Primaria' with
+    the first 'Categoría Padre' of the row where it first appears.
+    """
+    primary_names = split_category_column(df, 'Categoria Primaria').rename('name')
+    parent_names = split_category_column(df, 'Categoría Padre').rename('parent')
+    first_parent_names = parent_names[~parent_names.index.duplicated()]
+
+    pairs = primary_names.to_frame().join(first_parent_names, how='inner')
+    pairs = pairs[pairs['name'] != pairs['parent']].drop_duplicates(subset=['name'])
+    return dict(zip(pairs['name'], pairs['parent']))
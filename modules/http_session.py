@@ -0,0 +1,241 @@
+import contextlib
+import logging
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+import woocommerce.api
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that applies a default timeout to requests sent without one.
+    """
+
+    def __init__(self, *args, timeout=None, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def create_session(pool_maxsize, timeout, pool_connections=4, session=None):
+    """
+    Create a keep-alive session holding up to pool_maxsize open connections per
+    host, for pool_connections hosts. Pass session to configure a custom one.
+    """
+    session = session or requests.Session()
+    adapter = TimeoutHTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, timeout=timeout)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def use_session_for_woocommerce(session):
+    """
+    The woocommerce client sends every call through requests.request, which
+    opens a new connection each time. Route its calls through session instead.
+    """
+    woocommerce.api.request = session.request
+
+
+class CircuitOpenError(requests.RequestException):
+    """
+    Raised without sending the request while the circuit breaker is open.
+    """
+
+
+class TokenBucket:
+    """
+    Rate limiter shared by every thread using a session. It starts at max_rate
+    requests per second, halves the rate on each throttled response (and stops
+    every request until Retry-After has passed), and grows it back slowly
+    after each successful response.
+    """
+
+    def __init__(self, max_rate, min_rate, burst):
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate)
+        self.rate = max_rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self.updated_at = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def throttle(self, retry_after=None):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            if retry_after:
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+            logging.warning(f"Throttled by the server, slowing down to {self.rate:.2f} requests/s.")
+
+    def recover(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 100)
+
+
+class CircuitBreaker:
+    """
+    Stop sending requests after failure_threshold consecutive failures. After
+    reset_timeout seconds a single trial request is let through: its success
+    closes the circuit again, its failure keeps it open for another period.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_progress = False
+        self.lock = threading.Lock()
+
+    def before_request(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if self.trial_in_progress or time.monotonic() - self.opened_at < self.reset_timeout:
+                raise CircuitOpenError("Circuit breaker open, the server is failing.")
+            self.trial_in_progress = True
+
+    def record_success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                logging.info("Circuit breaker closed, the server answers again.")
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_progress = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_progress = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logging.error(f"Circuit breaker opened after {self.failures} consecutive failures.")
+                self.opened_at = time.monotonic()
+
+
+def parse_retry_after(response):
+    """
+    Return the seconds to wait from the Retry-After header, or None.
+    """
+    retry_after = response.headers.get('Retry-After')
+    if not retry_after:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_connect_error(error):
+    """
+    True when the request failed before reaching the server, so it is safe to
+    send it again whatever its method.
+    """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+class ResilientSession(requests.Session):
+    """
+    Session that rate limits, retries and stops sending requests when the
+    server degrades.
+
+    Throttled responses (429) are retried for every method, as the server did
+    not process them. Server errors (5xx), timeouts and dropped connections are
+    retried with jittered exponential backoff only for idempotent requests:
+    GET/HEAD/PUT/DELETE/OPTIONS, or any request sent with idempotent=True.
+
+    With max_concurrency, at most that many requests are in flight at once,
+    whatever the number of threads sharing the session, so they never need
+    more connections than its pool keeps. With batch_timeout, POST requests to
+    a '/batch' endpoint wait that long for an answer instead of the usual
+    timeout: a batch of creates sideloads the images of every product in it.
+    """
+
+    IDEMPOTENT_METHODS = {'GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'}
+    RETRY_STATUSES = {500, 502, 503, 504}
+
+    def __init__(self, rate_limiter, circuit_breaker, max_retries, backoff_base, backoff_max, max_concurrency=None, batch_timeout=None):
+        super().__init__()
+        self.slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency else contextlib.nullcontext()
+        self.batch_timeout = batch_timeout
+        self.rate_limiter = rate_limiter
+        self.circuit_breaker = circuit_breaker
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def request(self, method, url, *args, idempotent=None, **kwargs):
+        if idempotent is None:
+            idempotent = method.upper() in self.IDEMPOTENT_METHODS
+        if self.batch_timeout and method.upper() == 'POST' and urlsplit(url).path.endswith('/batch'):
+            kwargs['timeout'] = self.batch_timeout
+        attempt = 0
+        while True:
+            self.circuit_breaker.before_request()
+            self.rate_limiter.acquire()
+            try:
+                with self.slots:
+                    response = super().request(method, url, *args, **kwargs)
+            except requests.RequestException as e:
+                # Any failure, e.g. a body cut short, counts, or a failed trial would keep the circuit open for good
+                self.circuit_breaker.record_failure()
+                retryable = isinstance(e, (requests.ConnectionError, requests.Timeout))
+                if attempt >= self.max_retries or not retryable or not (idempotent or _is_connect_error(e)):
+                    raise
+                delay = self.backoff(attempt)
+                logging.warning(f"{method} {urlsplit(url).path} failed ({e}), retrying in {delay:.1f}s.")
+            else:
+                if response.status_code == 429:
+                    # The server is healthy, just asking to slow down
+                    self.circuit_breaker.record_success()
+                    retry_after = parse_retry_after(response)
+                    self.rate_limiter.throttle(retry_after)
+                    if attempt >= self.max_retries:
+                        return response
+                    delay = 0 if retry_after is not None else self.backoff(attempt)
+                elif response.status_code in self.RETRY_STATUSES:
+                    self.circuit_breaker.record_failure()
+                    if attempt >= self.max_retries or not idempotent:
+                        return response
+                    delay = parse_retry_after(response) or self.backoff(attempt)
+                    logging.warning(f"{method} {urlsplit(url).path} answered {response.status_code}, retrying in {delay:.1f}s.")
+                else:
+                    self.circuit_breaker.record_success()
+                    self.rate_limiter.recover()
+                    return response
+            attempt += 1
+            time.sleep(delay)
@@ -0,0 +1,57 @@
+import logging
+import time
+
+from config.settings import IMAGE_CACHE_PATH, IMAGE_CACHE_TTL_HOURS, IMAGE_CACHE_MISS_TTL_HOURS
+from .local_store import load_json, save_json
+
+# Resolved image URLs by Ailoo image path: {path: {"url": str, "checked_at": float}}
+# An empty url records that no size variant of the image exists.
+_cache = None
+
+
+def _get_cache():
+    global _cache
+    if _cache is None:
+        _cache = load_json(IMAGE_CACHE_PATH, {})
+    return _cache
+
+
+def _cache_key(image_path):
+    return image_path.strip().lstrip('/')
+
+
+def get_cached_image_url(image_path):
+    """
+    Return the cached URL for an image path, '' when the image is known to be
+    missing, or None when the path is unknown or its entry has expired.
+    """
+    entry = _get_cache().get(_cache_key(image_path))
+    if entry is None:
+        return None
+    ttl_hours = IMAGE_CACHE_TTL_HOURS if entry['url'] else IMAGE_CACHE_MISS_TTL_HOURS
+    if time.time() - entry['checked_at'] > ttl_hours * 3600:
+        return None
+    return entry['url']
+
+
+def set_cached_image_url(image_path, image_url):
+    _get_cache()[_cache_key(image_path)] = {"url": image_url, "checked_at": time.time()}
+
+
+def invalidate_image_cache(image_paths=None):
+    """
+    Drop the given image paths from the cache, or every entry when none are given.
+    """
+    cache = _get_cache()
+    if image_paths is None:
+        cache.clear()
+        logging.info("Image cache cleared.")
+        return
+    for image_path in image_paths:
+        cache.pop(_cache_key(image_path), None)
+
+
+def save_image_cache():
+    if _cache is not None:
+        save_json(IMAGE_CACHE_PATH, _cache)
+        logging.info(f"Saved {len(_cache)} image cache entries to '{IMAGE_CACHE_PATH}'.")
@@ -1,51 +1,144 @@
 import logging
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
 
 import pandas as pd
 import requests
 import imghdr
 
-from config.settings import BASE_IMAGE_URL
-
-def process_image_urls(image_paths, product_id):
-    if pd.isna(image_paths) or image_paths.strip() == '':
-        logging.info(f"Producto ID {product_id} no tiene imágenes.")
-        return ''
-    image_paths_list = [path.strip() for path in image_paths.split(',') if path.strip()]
-    processed_image_urls = []
-    for image_path in image_paths_list:
-        image_url = process_single_image_url(image_path, product_id)
-        if image_url:
-            processed_image_urls.append(image_url)
-    return ', '.join(processed_image_urls)
-
-def process_single_image_url(image_path, product_id):
+from config.settings import BASE_IMAGE_URL, IMAGE_PROBE_WORKERS, IMAGE_PROBE_MAX_PER_HOST, image_session
+from .image_cache import get_cached_image_url, set_cached_image_url
+from .metrics import record_cache
+
+# Size variants in order of preference
+SIZE_SUFFIXES = ['_900', '_150', '_75']
+
+# Limit of simultaneous probes per image host
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+
+
+def _get_host_semaphore(url):
+    host = urlparse(url).netloc
+    with _host_semaphores_lock:
+        if host not in _host_semaphores:
+            _host_semaphores[host] = threading.BoundedSemaphore(IMAGE_PROBE_MAX_PER_HOST)
+        return _host_semaphores[host]
+
+
+def split_image_paths(image_paths):
+    if pd.isna(image_paths) or str(image_paths).strip() == '':
+        return []
+    return [path.strip() for path in str(image_paths).split(',') if path.strip()]
+
+
+def get_candidate_image_urls(image_path, product_id):
+    """
+    Return the URLs of every size variant of an Ailoo image path, in order of
+    preference, or an empty list when the path is malformed.
+    """
     image_path = image_path.lstrip('/')
     parts = image_path.split('/')
     if len(parts) != 2:
         logging.warning(f"Formato inesperado de imagen para el producto ID {product_id}: '{image_path}'")
-        return ''
+        return []
     domain_id, image_filename = parts
     image_name, ext = os.path.splitext(image_filename)
     if len(image_name) < 3:
         logging.warning(f"Nombre de imagen inválido para el producto ID {product_id}: '{image_filename}'")
-        return ''
+        return []
     first_three_chars = image_name[:3]
     first_char = first_three_chars[0]
     next_two_chars = first_three_chars[1:]
 
-    sizes = ['_900', '_150', '_75']
-    for size_suffix in sizes:
+    candidate_urls = []
+    for size_suffix in SIZE_SUFFIXES:
         new_image_name = f"{image_name}{size_suffix}{ext}"
-        image_url = f"{BASE_IMAGE_URL}/Content/products/{domain_id}/{first_char}/{next_two_chars}/{new_image_name}"
-        try:
-            headers = {'Range': 'bytes=0-1023'}  # Descargar solo los primeros bytes
-            response = requests.get(image_url, headers=headers, timeout=5)
-            content_type = response.headers.get('Content-Type', '')
-            if 'image' in content_type.lower() or imghdr.what(None, h=response.content):
-                return image_url
-        except requests.RequestException as e:
-            logging.debug(f"Error al verificar la imagen para el producto ID {product_id}: {e}")
+        candidate_urls.append(f"{BASE_IMAGE_URL}/Content/products/{domain_id}/{first_char}/{next_two_chars}/{new_image_name}")
+    return candidate_urls
+
+
+def probe_image_url(image_url):
+    """
+    Return True when the URL serves an image. Network errors are raised.
+    """
+    headers = {'Range': 'bytes=0-1023'}  # Descargar solo los primeros bytes
+    with _get_host_semaphore(image_url):
+        response = image_session.get(image_url, headers=headers)
+    content_type = response.headers.get('Content-Type', '')
+    return 'image' in content_type.lower() or bool(imghdr.what(None, h=response.content))
+
+
+def resolve_image_paths(image_paths):
+    """
+    Resolve many Ailoo image paths at once. image_paths maps each path to the
+    product ID used in log messages. Every size variant of every uncached path
+    is probed concurrently, and the best available variant is kept.
+    Returns {image_path: url}, with '' for images that were not found.
+    """
+    resolved = {}
+    pending = {}
+    for image_path, product_id in image_paths.items():
+        cached_url = get_cached_image_url(image_path)
+        if cached_url is not None:
+            resolved[image_path] = cached_url
             continue
-    logging.warning(f"No se encontró imagen disponible para el producto ID {product_id} con la ruta '{image_path}'.")
-    return ''
+        candidate_urls = get_candidate_image_urls(image_path, product_id)
+        if candidate_urls:
+            pending[image_path] = candidate_urls
+        else:
+            resolved[image_path] = ''
+
+    record_cache('image_url', hits=len(image_paths) - len(pending), misses=len(pending))
+    if not pending:
+        return resolved
+
+    logging.info(f"Verificando {len(pending)} imágenes sin caché...")
+    with ThreadPoolExecutor(max_workers=IMAGE_PROBE_WORKERS) as executor:
+        futures = {
+            image_path: [executor.submit(probe_image_url, url) for url in candidate_urls]
+            for image_path, candidate_urls in pending.items()
+        }
+        for image_path, path_futures in futures.items():
+            image_url = ''
+            probe_failed = False
+            for candidate_url, future in zip(pending[image_path], path_futures):
+                try:
+                    if future.result():
+                        image_url = candidate_url
+                        break
+                except requests.RequestException as e:
+                    logging.debug(f"Error al verificar la imagen para el producto ID {image_paths[image_path]}: {e}")
+                    probe_failed = True
+
+            if image_url:
+                set_cached_image_url(image_path, image_url)
+            else:
+                logging.warning(f"No se encontró imagen disponible para el producto ID {image_paths[image_path]} con la ruta '{image_path}'.")
+                # Only remember the missing image when every size answered, not after a network error
+                if not probe_failed:
+                    set_cached_image_url(image_path, '')
+            resolved[image_path] = image_url
+    return resolved
+
+
+def resolve_dataframe_images(df):
+    """
+    Resolve the 'Imagenes Ailoo' column of a whole DataFrame in a single
+    concurrent stage. Returns a Series aligned with df holding the
+    comma-separated URLs of each row, in the order of its image paths.
+    """
+    paths_by_row = [split_image_paths(image_paths) for image_paths in df['Imagenes Ailoo']]
+
+    image_paths = {}
+    for paths, product_id in zip(paths_by_row, df['Id']):
+        for path in paths:
+            image_paths.setdefault(path, product_id)
+
+    resolved = resolve_image_paths(image_paths)
+
+    image_urls = [', '.join(resolved[path] for path in paths if resolved[path]) for paths in paths_by_row]
+    return pd.Series(image_urls, index=df.index, dtype=object)
+
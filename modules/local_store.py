@@ -0,0 +1,30 @@
+import json
+import logging
+import os
+
+
+def load_json(path, default=None):
+    """
+    Load a JSON file, returning default when it does not exist or is corrupt.
+    """
+    if not os.path.exists(path):
+        return default
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Could not read '{path}', starting from scratch: {e}")
+        return default
+
+
+def save_json(path, data):
+    """
+    Write data as JSON atomically, so an interrupted run never leaves a half-written file.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
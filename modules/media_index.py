@@ -0,0 +1,112 @@
+import logging
+
+from config.settings import MEDIA_INDEX_PATH
+from .local_store import load_json, save_json
+from .metrics import record_cache
+from .product_diff import image_key
+
+# WooCommerce media library IDs by image key: {image_key(src): media_id}.
+# The key survives the sideload rename, so the Ailoo URL of an image and the
+# URL WordPress gave its copy share it. Images found here are sent as
+# references to the existing attachment instead of being downloaded again.
+_index = None
+
+
+def _get_index():
+    global _index
+    if _index is None:
+        _index = load_json(MEDIA_INDEX_PATH, {})
+    return _index
+
+
+def index_media(images):
+    """
+    Add the {"id", "src"} images of a WooCommerce product or variation.
+    """
+    index = _get_index()
+    for image in images:
+        if isinstance(image, dict) and image.get('id') and image.get('src'):
+            index[image_key(image['src'])] = int(image['id'])
+
+
+def index_product_media(df_wc):
+    """
+    Add the images of every product of a WooCommerce snapshot.
+    """
+    if df_wc.empty or 'images' not in df_wc.columns:
+        return
+    for images in df_wc['images']:
+        if isinstance(images, list):
+            index_media(images)
+    logging.info(f"Media index holds {len(_get_index())} WooCommerce images.")
+
+
+def _payload_images(payload):
+    if 'images' in payload:
+        return payload['images']
+    if payload.get('image'):
+        return [payload['image']]
+    return []
+
+
+def index_written_media(payload, result):
+    """
+    Add the media IDs WooCommerce answered for the images of a payload it
+    wrote. The answer lists the images in the order they were sent.
+    """
+    sent_images = _payload_images(payload)
+    written_images = _payload_images(result)
+    if len(sent_images) != len(written_images):
+        return
+    index = _get_index()
+    for sent, written in zip(sent_images, written_images):
+        if sent.get('src') and written.get('id'):
+            index[image_key(sent['src'])] = int(written['id'])
+
+
+def with_media_ids(payload):
+    """
+    Return the payload with the id of the existing attachment added to every
+    image the media library already holds, so WooCommerce links it instead of
+    sideloading its src again. The payload itself is left untouched.
+    """
+    images = _payload_images(payload)
+    if not images:
+        return payload
+    index = _get_index()
+    hits = 0
+    referenced = []
+    for image in images:
+        media_id = index.get(image_key(image['src'])) if image.get('src') and not image.get('id') else None
+        if media_id:
+            hits += 1
+            image = dict(image, id=media_id)
+        referenced.append(image)
+    record_cache('media', hits=hits, misses=len(images) - hits)
+    if not hits:
+        return payload
+    if 'images' in payload:
+        return dict(payload, images=referenced)
+    return dict(payload, image=referenced[0])
+
+
+def forget_media(payload):
+    """
+    Drop the images of a payload from the index, e.g. after WooCommerce
+    rejected an attachment ID deleted from the media library.
+    """
+    index = _get_index()
+    for image in _payload_images(payload):
+        if image.get('src'):
+            index.pop(image_key(image['src']), None)
+
+
+def is_invalid_image_error(error):
+    # woocommerce_product_invalid_image_id, woocommerce_variation_invalid_image_id
+    return 'invalid_image_id' in str(error.get('code', ''))
+
+
+def save_media_index():
+    if _index is not None:
+        save_json(MEDIA_INDEX_PATH, _index)
+        logging.info(f"Saved {len(_index)} WooCommerce media IDs to '{MEDIA_INDEX_PATH}'.")
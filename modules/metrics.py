@@ -0,0 +1,233 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from .local_store import save_json
+
+# Upper bounds of the request latency histogram, in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, float('inf'))
+
+# Prefix of every Prometheus metric name
+METRIC_PREFIX = 'ailoo_sync'
+
+# Metrics of the current run. Every thread of the sync updates them, under _lock.
+_lock = threading.Lock()
+_started_at = time.time()
+# Seconds spent in each stage: {stage: seconds}
+_stages = {}
+# {(host, endpoint, method, status): {"requests": int, "bytes_sent": int, "bytes_received": int}}
+_http = {}
+# {(host, endpoint): {"buckets": [int], "sum": float, "count": int}}
+_latency = {}
+# {cache: {"hits": int, "misses": int}}
+_caches = {}
+
+_ID_SEGMENT = re.compile(r'^\d+$')
+
+
+@contextmanager
+def stage_timer(stage):
+    """
+    Add the time spent in the block to stage. A stage timed more than once,
+    e.g. once per batch, accumulates.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        with _lock:
+            _stages[stage] = _stages.get(stage, 0.0) + seconds
+
+
+def record_cache(cache, hits=0, misses=0):
+    with _lock:
+        counts = _caches.setdefault(cache, {"hits": 0, "misses": 0})
+        counts["hits"] += hits
+        counts["misses"] += misses
+
+
+def endpoint_label(url, max_path_segments=None):
+    """
+    Path of url with its numeric segments replaced by ':id', cut to
+    max_path_segments segments, so labels don't grow with the catalog.
+    """
+    segments = [segment for segment in urlsplit(url).path.split('/') if segment]
+    segments = [':id' if _ID_SEGMENT.match(segment) else segment for segment in segments]
+    if max_path_segments is not None:
+        segments = segments[:max_path_segments]
+    return '/' + '/'.join(segments)
+
+
+def _body_size(body):
+    if isinstance(body, (bytes, str)):
+        return len(body)
+    return 0
+
+
+def record_response(response, max_path_segments=None, stream=False):
+    """
+    Count a response of a requests session. Its latency is the time until the
+    response headers arrived. The body of streamed responses isn't read, so
+    they count their Content-Length.
+    """
+    request = response.request
+    host = urlsplit(request.url).netloc
+    endpoint = endpoint_label(request.url, max_path_segments)
+    if stream:
+        received = int(response.headers.get('Content-Length') or 0)
+    else:
+        received = len(response.content)
+    seconds = response.elapsed.total_seconds()
+
+    with _lock:
+        counts = _http.setdefault((host, endpoint, request.method, response.status_code), {
+            "requests": 0, "bytes_sent": 0, "bytes_received": 0
+        })
+        counts["requests"] += 1
+        counts["bytes_sent"] += _body_size(request.body)
+        counts["bytes_received"] += received
+
+        latency = _latency.setdefault((host, endpoint), {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0})
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                latency["buckets"][i] += 1
+        latency["sum"] += seconds
+        latency["count"] += 1
+
+
+def install_http_metrics(session, max_path_segments=None):
+    """
+    Count every response of session, retries included, with a response hook.
+    Use max_path_segments for hosts whose paths aren't endpoints, like images.
+    """
+    def hook(response, *args, **kwargs):
+        record_response(response, max_path_segments, stream=kwargs.get('stream', False))
+        return response
+
+    session.hooks['response'].append(hook)
+    return session
+
+
+def get_metrics(status=None):
+    """
+    Return the metrics of the run so far as a JSON-serializable dict.
+    """
+    finished_at = time.time()
+    with _lock:
+        http = [
+            dict(host=host, endpoint=endpoint, method=method, status=status_code, **counts)
+            for (host, endpoint, method, status_code), counts in sorted(_http.items(), key=lambda item: str(item[0]))
+        ]
+        latency = [
+            dict(host=host, endpoint=endpoint, buckets=dict(zip(map(str, LATENCY_BUCKETS), histogram["buckets"])),
+                 sum=histogram["sum"], count=histogram["count"])
+            for (host, endpoint), histogram in sorted(_latency.items())
+        ]
+        return {
+            "status": status,
+            "started_at": _started_at,
+            "finished_at": finished_at,
+            "duration_seconds": finished_at - _started_at,
+            "stages": dict(_stages),
+            "http": http,
+            "http_latency": latency,
+            "caches": {cache: dict(counts) for cache, counts in _caches.items()},
+        }
+
+
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def format_prometheus(metrics):
+    """
+    Render metrics in the Prometheus text format, for the node_exporter
+    textfile collector.
+    """
+    p = METRIC_PREFIX
+    lines = [
+        f"# HELP {p}_run_duration_seconds Wall time of the last sync run.",
+        f"# TYPE {p}_run_duration_seconds gauge",
+        f"{p}_run_duration_seconds {metrics['duration_seconds']}",
+        f"# HELP {p}_run_success Whether the last sync run finished without errors.",
+        f"# TYPE {p}_run_success gauge",
+        f"{p}_run_success {int(metrics['status'] == 'success')}",
+        f"# HELP {p}_run_finished_timestamp_seconds When the last sync run finished.",
+        f"# TYPE {p}_run_finished_timestamp_seconds gauge",
+        f"{p}_run_finished_timestamp_seconds {metrics['finished_at']}",
+        f"# HELP {p}_stage_duration_seconds Time spent in each stage of the last sync run.",
+        f"# TYPE {p}_stage_duration_seconds gauge",
+    ]
+    lines += [f"{p}_stage_duration_seconds{_labels(stage=stage)} {seconds}" for stage, seconds in metrics['stages'].items()]
+
+    for name, field, description in [
+        ('http_requests_total', 'requests', "HTTP requests sent, retries included."),
+        ('http_request_bytes_total', 'bytes_sent', "Bytes of the HTTP request bodies."),
+        ('http_response_bytes_total', 'bytes_received', "Bytes of the HTTP response bodies."),
+    ]:
+        lines += [f"# HELP {p}_{name} {description}", f"# TYPE {p}_{name} counter"]
+        lines += [
+            f"{p}_{name}{_labels(host=row['host'], endpoint=row['endpoint'], method=row['method'], status=row['status'])} {row[field]}"
+            for row in metrics['http']
+        ]
+
+    lines += [
+        f"# HELP {p}_http_request_duration_seconds Time until the HTTP response headers arrived.",
+        f"# TYPE {p}_http_request_duration_seconds histogram",
+    ]
+    for row in metrics['http_latency']:
+        for bound, count in row['buckets'].items():
+            le = '+Inf' if bound == 'inf' else bound
+            lines.append(f"{p}_http_request_duration_seconds_bucket{_labels(host=row['host'], endpoint=row['endpoint'], le=le)} {count}")
+        lines.append(f"{p}_http_request_duration_seconds_sum{_labels(host=row['host'], endpoint=row['endpoint'])} {row['sum']}")
+        lines.append(f"{p}_http_request_duration_seconds_count{_labels(host=row['host'], endpoint=row['endpoint'])} {row['count']}")
+
+    lines += [
+        f"# HELP {p}_cache_requests_total Cache lookups by result.",
+        f"# TYPE {p}_cache_requests_total counter",
+    ]
+    for cache, counts in metrics['caches'].items():
+        lines.append(f"{p}_cache_requests_total{_labels(cache=cache, result='hit')} {counts['hits']}")
+        lines.append(f"{p}_cache_requests_total{_labels(cache=cache, result='miss')} {counts['misses']}")
+    return '\n'.join(lines) + '\n'
+
+
+def write_metrics(status, json_path, textfile_path=None, history_path=None):
+    """
+    Write the metrics of the run as JSON and, optionally, as a Prometheus
+    textfile and as a line appended to a JSON Lines history of every run.
+    """
+    metrics = get_metrics(status)
+    save_json(json_path, metrics)
+
+    if textfile_path:
+        directory = os.path.dirname(textfile_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # The textfile collector may read the file at any time, so replace it atomically
+        tmp_path = f"{textfile_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(format_prometheus(metrics))
+        os.replace(tmp_path, textfile_path)
+
+    if history_path:
+        directory = os.path.dirname(history_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(history_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(metrics, ensure_ascii=False) + '\n')
+
+    logging.info(
+        f"Run metrics written to '{json_path}': {metrics['duration_seconds']:.1f} s, "
+        f"{sum(row['requests'] for row in metrics['http'])} HTTP requests."
+    )
+    return metrics
@@ -0,0 +1,72 @@
+import logging
+import threading
+from queue import Queue
+
+import pandas as pd
+
+from config.settings import WC_BATCH_SIZE, PIPELINE_MAX_PENDING_BATCHES
+
+# Marks the end of the formatted batches in the queue
+_DONE = object()
+
+
+def iter_chunks(df, chunk_size):
+    """
+    Split a DataFrame in chunks of chunk_size products. The rows of a variable
+    product always stay in the same chunk.
+    """
+    if df.empty:
+        return
+    product_numbers, _ = pd.factorize(df['Id'])
+    for _, chunk in df.groupby(product_numbers // chunk_size):
+        yield chunk
+
+
+def stream_batches(batches, max_pending=PIPELINE_MAX_PENDING_BATCHES):
+    """
+    Consume the batches iterator in a background thread and yield its batches
+    through a queue of max_pending batches. The producer blocks when the
+    consumer falls behind, so at most max_pending batches are held in memory.
+    Errors raised by the producer are raised again here.
+    """
+    queue = Queue(maxsize=max_pending)
+    errors = []
+
+    def produce():
+        try:
+            for batch in batches:
+                queue.put(batch)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            queue.put(_DONE)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    while (batch := queue.get()) is not _DONE:
+        yield batch
+    thread.join()
+    if errors:
+        raise errors[0]
+
+
+def stream_products(df, format_chunk, write_batch, chunk_size=WC_BATCH_SIZE, on_written=None):
+    """
+    Format df in chunks of chunk_size products and write each batch as soon as
+    it is formatted, while the next chunk is being formatted. on_written is
+    called with the results of each batch. Returns the number of payloads sent
+    and the merged results of write_batch.
+    """
+    formatted_batches = (format_chunk(chunk) for chunk in iter_chunks(df, chunk_size))
+    sent = 0
+    written = {}
+    for payloads in stream_batches(formatted_batches):
+        if not payloads:
+            continue
+        batch_written = write_batch(payloads)
+        if on_written:
+            on_written(batch_written)
+        written.update(batch_written)
+        sent += len(payloads)
+        logging.info(f"Sent {sent} products so far.")
+    return sent, written
@@ -1,18 +1,17 @@
 import pandas as pd
 import logging
 
-from .image_processing import process_image_urls
-from .woocommerce_api import get_variations_for_product
-from .alioo.alioo_inventory import get_product_item_id
+from .image_processing import resolve_dataframe_images
+from .woocommerce_api import get_variations_for_products, write_products_batch, write_variations_batch
+from .alioo.alioo_inventory import get_product_item_ids
+from .product_diff import is_changed, VARIATION_DIFF_FIELDS
+from .product_state import get_stored_variations, record_variation, forget_missing_variations, rename_product
 
 def pre_process_df(df_excel):
     # Remove products without SKU from df_excel
     df_excel = df_excel.dropna(subset=['SKU'])
     df_excel = df_excel[df_excel['SKU'].astype(str).str.strip() != '']
 
-    # Add categories column to df_excel
-    df_excel['categories'] = None
-
     # Return the updated dataframe
     return df_excel
 
@@ -21,10 +20,89 @@ def map_sku_to_id(df_wc):
     sku_to_id = df_wc.set_index('sku')['id'].to_dict()
     return sku_to_id
 
+def get_parent_sku(product_id):
+    """
+    Generate the parent SKU from the Ailoo Id of the product, which stays the
+    same when the product is renamed.
+    """
+    if isinstance(product_id, float) and product_id.is_integer():
+        product_id = int(product_id)
+    return f"ailoo-{product_id}"
+
+
+def get_legacy_parent_sku(product_name):
+    # Parent SKU of the products created when it was based on the name of the product
+    return str(product_name).lower().replace(' ', '-')
+
+
+def get_product_skus(df):
+    """
+    Return the SKU of the WooCommerce product each row belongs to: its own SKU
+    for simple products, the parent SKU for the variations of variable products.
+    """
+    id_counts = df['Id'].map(df['Id'].value_counts())
+    parent_skus = df['Id'].map(get_parent_sku)
+    return df['SKU'].where(id_counts == 1, parent_skus)
+
+
+def migrate_legacy_parent_skus(wcapi, df_excel, df_wc):
+    """
+    Give the variable products still identified by the slug of their name the
+    SKU of their Ailoo Id, so they are matched instead of deleted and created
+    again. A slug shared by several Ailoo products goes to the first one, and
+    the variations of the others are removed from it, so they can be created
+    under their own parent. Products that can't be moved are left out of the
+    run. Returns df_excel and df_wc.
+    """
+    if df_wc.empty or 'sku' not in df_wc.columns:
+        return df_excel, df_wc
+
+    wc_skus = set(df_wc['sku'])
+    legacy_skus = set(df_wc.loc[df_wc['type'] == 'variable', 'sku']) if 'type' in df_wc.columns else set()
+    df_variable = df_excel[df_excel['Id'].duplicated(keep=False)]
+    renames = {}
+    for product_id, group in df_variable.groupby('Id', sort=False):
+        parent_sku = get_parent_sku(product_id)
+        legacy_sku = get_legacy_parent_sku(group['Producto'].iloc[0])
+        if parent_sku not in wc_skus and legacy_sku in legacy_skus and legacy_sku not in renames:
+            renames[legacy_sku] = parent_sku
+    if not renames:
+        return df_excel, df_wc
+
+    logging.info(f"Moving {len(renames)} variable products to the SKU of their Ailoo Id.")
+    sku_to_id = map_sku_to_id(df_wc)
+    migrated = write_products_batch(wcapi, 'update', [{"id": sku_to_id[legacy_sku], "sku": parent_sku} for legacy_sku, parent_sku in renames.items()])
+    for legacy_sku, parent_sku in renames.items():
+        if parent_sku in migrated:
+            rename_product(legacy_sku, parent_sku)
+
+    # A parent whose slug other Ailoo products shared also holds their variations
+    parent_skus = get_product_skus(df_variable)
+    slug_counts = df_variable.drop_duplicates(subset=['Id'])['Producto'].map(get_legacy_parent_sku).value_counts()
+    shared_parents = {
+        sku_to_id[legacy_sku]: parent_sku for legacy_sku, parent_sku in renames.items()
+        if parent_sku in migrated and slug_counts[legacy_sku] > 1
+    }
+    for parent_id, variations in get_variations_for_products(wcapi, shared_parents).items():
+        other_skus = set(df_variable.loc[parent_skus != shared_parents[parent_id], 'SKU'])
+        foreign_ids = [variation['id'] for variation in variations if variation.get('sku') in other_skus]
+        if foreign_ids:
+            write_variations_batch(wcapi, parent_id, delete=foreign_ids)
+
+    # Leave the products that couldn't be moved for the next run
+    failed = {legacy_sku: parent_sku for legacy_sku, parent_sku in renames.items() if parent_sku not in migrated}
+    if failed:
+        logging.warning(f"Could not move {len(failed)} variable products to the SKU of their Ailoo Id, skipping them.")
+        df_excel = df_excel[~get_product_skus(df_excel).isin(failed.values())]
+        df_wc = df_wc[~df_wc['sku'].isin(failed)]
+    return df_excel, df_wc.assign(sku=df_wc['sku'].replace(renames))
+
+
 def identify_products(df_excel, df_wc):
 
-    # SKUs in Excel
-    excel_skus = set(df_excel['SKU'])
+    # Product SKUs in Excel (variations are matched through their parent)
+    product_skus = get_product_skus(df_excel)
+    excel_skus = set(product_skus)
 
     # SKUs in WooCommerce
     if not df_wc.empty and 'sku' in df_wc.columns:
@@ -33,12 +111,10 @@ def identify_products(df_excel, df_wc):
         wc_skus = set()
 
     # New products: SKUs in Excel but not in WooCommerce
-    new_skus = excel_skus - wc_skus
-    df_new = df_excel[df_excel['SKU'].isin(new_skus)]
+    df_new = df_excel[~product_skus.isin(wc_skus)]
 
     # Updated products: SKUs in both Excel and WooCommerce
-    updated_skus = excel_skus & wc_skus
-    df_updated = df_excel[df_excel['SKU'].isin(updated_skus)]
+    df_updated = df_excel[product_skus.isin(wc_skus)]
 
     # Products to delete: SKUs in WooCommerce but not in Excel
     delete_skus = wc_skus - excel_skus
@@ -49,15 +125,6 @@ def identify_products(df_excel, df_wc):
 
     return df_new, df_updated, df_delete
 
-def map_variation_sku_to_id(variations):
-    sku_to_id = {}
-    for variation in variations:
-        sku = variation.get('sku')
-        if sku:
-            sku_to_id[sku] = variation['id']
-    return sku_to_id
-
-
 def separate_simple_and_variable(df):
     # Count how many times each Id appears
     id_counts = df['Id'].value_counts()
@@ -73,207 +140,203 @@ def separate_simple_and_variable(df):
     return df_simple, df_variable
 
 
-def format_simple_products(df_simple, category_name_to_id):
+def clean_text_column(df, column):
+    """
+    Return a column as stripped strings, with '' for missing values or a missing column.
+    """
+    if column not in df.columns:
+        return pd.Series('', index=df.index, dtype=object)
+    return df[column].fillna('').astype(str).str.strip()
+
+
+def split_list_column(df, column):
+    """
+    Return a comma-separated column as lists of stripped, non-empty values.
+    """
+    split_values = clean_text_column(df, column).str.split(r'\s*,\s*', regex=True)
+    return [[value for value in values if value] for values in split_values]
+
+
+def build_simple_product_payloads(df_simple, row_category_ids, sku_to_id=None):
+    """
+    Build the WooCommerce payloads of simple products column by column.
+    Without sku_to_id the payloads create products; with it they update the
+    existing ones, and rows whose SKU is not in WooCommerce are skipped.
+    """
+    # Resolve the images and Ailoo IDs of every product up front
+    image_urls_by_row = resolve_dataframe_images(df_simple)
+    product_item_ids = get_product_item_ids(df_simple['SKU'])
+
+    # Clean and split every column once
+    skus = df_simple['SKU'].tolist()
+    names = df_simple['Producto'].tolist()
+    prices = df_simple['Precio'].astype(str).tolist()
+    category_ids = [row_category_ids.get(index, []) for index in df_simple.index]
+    descriptions = clean_text_column(df_simple, 'Descripción').tolist()
+    if 'Stock:Mundo Bikes' in df_simple.columns:
+        stocks = pd.to_numeric(df_simple['Stock:Mundo Bikes'], errors='coerce').fillna(0).astype(int).tolist()
+    else:
+        stocks = [0] * len(df_simple)
+    brands = clean_text_column(df_simple, 'Marca').tolist()
+    models = clean_text_column(df_simple, 'Modelo').tolist()
+    sizes = split_list_column(df_simple, 'Tamaños')
+    colors = split_list_column(df_simple, 'Colores')
+    image_urls = [[url for url in urls.split(', ') if url] for urls in image_urls_by_row]
+
     products = []
-    for index, row in df_simple.iterrows():
+    for i, sku in enumerate(skus):
+
+        if sku_to_id is not None:
+            product_id = sku_to_id.get(sku)
+            if not product_id:
+                continue # Cannot update a product that doesn't exist
+
+        # Getting product item id from alioo
+        product_item_id = product_item_ids.get(str(sku))
+        if not product_item_id:
+            logging.warning(f"Product with SKU '{sku}' not found in Alioo.")
+            continue
 
-        # Get category IDs
-        categories = []
-        primary_category = str(row['Categoria Primaria']).strip()
-        parent_category = str(row['Categoría Padre']).strip()
-        if primary_category and primary_category in category_name_to_id:
-            categories.append({"id": category_name_to_id[primary_category]})
-        if parent_category and parent_category in category_name_to_id:
-            categories.append({"id": category_name_to_id[parent_category]})
+        categories = [{"id": category_id} for category_id in category_ids[i]]
 
         product = {
-            "name": row['Producto'],
-            "type": "simple",
-            "regular_price": str(row['Precio']),
-            "sku": row['SKU'],
-            "description": row['Descripción'] if 'Descripción' in row and not pd.isna(row['Descripción']) else '',
+            "name": names[i],
+            "regular_price": prices[i],
+            "sku": sku,
             "categories": categories,
-            # "tags": [{"name": tag.strip()} for tag in str(row['Etiquetas']).split(',') if tag.strip()],
             "manage_stock": True,
-            "stock_quantity": int(row['Stock:Mundo Bikes']) if 'Stock:Mundo Bikes' in row and not pd.isna(row['Stock:Mundo Bikes']) else 0,
+            "stock_quantity": stocks[i],
         }
+        if sku_to_id is None:
+            product["type"] = "simple"
+            product["description"] = descriptions[i]
+        else:
+            product["id"] = product_id
+            product["backorders"] = "no"
 
-        # Process images using the process_image_urls function
-        image_urls = process_image_urls(row['Imagenes Ailoo'], row['Id'])
-        if image_urls:
-            product["images"] = [{"src": url.strip()} for url in image_urls.split(',') if url.strip()]
+        if image_urls[i]:
+            product["images"] = [{"src": url} for url in image_urls[i]]
 
-        # Update custom fields as attributes
+        # Custom fields as attributes
         attributes = []
+        if brands[i]:
+            attributes.append({"name": "Marca", "options": [brands[i]], "visible": True, "variation": False})
+        if models[i]:
+            attributes.append({"name": "Modelo", "options": [models[i]], "visible": True, "variation": False})
+        if sizes[i]:
+            attributes.append({"name": "Tamaño", "options": sizes[i], "visible": True, "variation": False})
+        if colors[i]:
+            attributes.append({"name": "Color", "options": colors[i], "visible": True, "variation": False})
+        attributes.append({"name": "Proveedor", "options": "Alioo", "visible": False, "variation": False})
+        attributes.append({"name": "Alioo ID", "options": product_item_id, "visible": False, "variation": False})
+        product['attributes'] = attributes
 
-        # Brand
-        if 'Marca' in row and not pd.isna(row['Marca']) and row['Marca'].strip():
-            attributes.append({
-                "name": "Marca",
-                "options": [row['Marca']],
-                "visible": True,
-                "variation": False
-            })
+        products.append(product)
+    return products
 
-        # Model
-        if 'Modelo' in row and not pd.isna(row['Modelo']) and row['Modelo'].strip():
-            attributes.append({
-                "name": "Modelo",
-                "options": [row['Modelo']],
-                "visible": True,
-                "variation": False
-            })
 
-        # Sizes
-        if 'Tamaños' in row and not pd.isna(row['Tamaños']) and row['Tamaños'].strip():
-            tamanos = [size.strip() for size in str(row['Tamaños']).split(',') if size.strip()]
-            attributes.append({
-                "name": "Tamaño",
-                "options": tamanos,
-                "visible": True,
-                "variation": False
-            })
+def format_simple_products(df_simple, row_category_ids):
+    return build_simple_product_payloads(df_simple, row_category_ids)
 
-        # Colors
-        if 'Colores' in row and not pd.isna(row['Colores']) and row['Colores'].strip():
-            colores = [color.strip() for color in str(row['Colores']).split(',') if color.strip()]
-            attributes.append({
-                "name": "Color",
-                "options": colores,
-                "visible": True,
-                "variation": False
-            })
 
-        # Proveedor
-        attributes.append({ "name": "Proveedor", "options": "Alioo", "visible": False, "variation": False })
+PLURAL_TO_SINGULAR = {
+    'Tamaños': 'Tamaño',
+    'Colores': 'Color'
+}
 
-        # Getting product item id from alioo
-        product_item_id = get_product_item_id(row['SKU'])
 
-        if not product_item_id:
-            logging.warning(f"Product with SKU '{row['SKU']}' not found in Alioo.")
-            continue
+def build_variable_parent_attributes(first_row, group):
+    # Update custom fields as attributes
+    attributes = []
 
-        # Alioo ID
-        attributes.append({ "name": "Alioo ID", "options": product_item_id, "visible": False, "variation": False })
+    # Brand
+    if 'Marca' in first_row and not pd.isna(first_row['Marca']) and first_row['Marca'].strip():
+        attributes.append({
+            "name": "Marca",
+            "options": [first_row['Marca']],
+            "visible": True,
+            "variation": False # Assuming "Marca" is not a variation attribute
+        })
 
-        if attributes:
-            product['attributes'] = attributes
+    # Model
+    if 'Modelo' in first_row and not pd.isna(first_row['Modelo']) and first_row['Modelo'].strip():
+        attributes.append({
+            "name": "Modelo",
+            "options": [first_row['Modelo']],
+            "visible": True,
+            "variation": False # Assuming "Modelo" is not a variation attribute
+        })
 
-        products.append(product)
-    return products
+    # Variable attributes
+    for attr_name in ['Tamaños', 'Colores']:
+        if attr_name in group.columns:
+            values = group[attr_name].dropna().unique().tolist()
+            # Clean values and remove empty strings
+            cleaned_values = [str(value).strip() for value in values if str(value).strip()]
+            if cleaned_values:
+                attributes.append({
+                    "name": PLURAL_TO_SINGULAR[attr_name],
+                    "options": sorted(set(cleaned_values)),
+                    "visible": True,
+                    "variation": True
+                })
+
+    return attributes
+
+
+def build_variation(row, image_urls):
+    variation = {
+        "regular_price": str(row['Precio']),
+        "sku": row['SKU'],
+        "attributes": [],
+        "manage_stock": True,
+        "stock_quantity": int(row['Stock:Mundo Bikes']) if 'Stock:Mundo Bikes' in row and not pd.isna(row['Stock:Mundo Bikes']) else 0,
+    }
+
+    # Use the first image as the variation image
+    if image_urls:
+        variation["image"] = {"src": image_urls.split(',')[0].strip()}
+
+    # Add variation attributes
+    for attr_name in ['Tamaños', 'Colores']:
+        if attr_name in row and pd.notna(row[attr_name]) and str(row[attr_name]).strip():
+            variation['attributes'].append({
+                "name": PLURAL_TO_SINGULAR[attr_name],
+                "option": str(row[attr_name]).strip()
+            })
 
+    return variation
 
-def format_variable_products(df_variable):
+
+def format_variable_products(df_variable, row_category_ids):
     products = []
+
+    # Resolve the images of every variation up front
+    image_urls_by_row = resolve_dataframe_images(df_variable)
+
     # Group by Id
     grouped = df_variable.groupby('Id')
     for product_id, group in grouped:
         # Get the first row of the group
         first_row = group.iloc[0]
 
-        # Get category IDs
-        categories = []
-        # primary_category = str(first_row['Categoria Primaria']).strip()
-        # parent_category = str(first_row['Categoría Padre']).strip()
-        # if primary_category and primary_category in category_name_to_id:
-        #     categories.append({"id": category_name_to_id[primary_category]})
-        # if parent_category and parent_category in category_name_to_id:
-        #     categories.append({"id": category_name_to_id[parent_category]})
-
-        # Generate the parent SKU based on the name of the product
-        parent_sku = first_row['Producto'].lower().replace(' ', '-')
-
-
         # Parent product
         parent_product = {
             "name": first_row['Producto'],
             "type": "variable",
-            "sku": parent_sku,
+            "sku": get_parent_sku(product_id),
             "description": first_row['Descripción'] if 'Descripción' in first_row and not pd.isna(first_row['Descripción']) else '',
-            "categories": categories,
+            "categories": [{"id": category_id} for category_id in row_category_ids.get(group.index[0], [])],
             # "tags": [{"name": tag.strip()} for tag in str(first_row['Etiquetas']).split(',') if tag.strip()],
-            "images": []
+            "attributes": build_variable_parent_attributes(first_row, group),
         }
 
-        # Update custom fields as attributes
-        attributes = []
-
-        # Brand
-        if 'Marca' in first_row and not pd.isna(first_row['Marca']) and first_row['Marca'].strip():
-            attributes.append({
-                "name": "Marca",
-                "options": [first_row['Marca']],
-                "visible": True,
-                "variation": False # Assuming "Marca" is not a variation attribute
-            })
-
-        # Model
-        if 'Modelo' in first_row and not pd.isna(first_row['Modelo']) and first_row['Modelo'].strip():
-            attributes.append({
-                "name": "Modelo",
-                "options": [first_row['Modelo']],
-                "visible": True,
-                "variation": False # Assuming "Modelo" is not a variation attribute
-            })
-
-        plural_to_singular = {
-            'Tamaños': 'Tamaño',
-            'Colores': 'Color'
-        }
-
-        # Variable attributes
-        variable_attributes = {}
-        for attr_name in ['Tamaños', 'Colores']:
-            if attr_name in group.columns:
-                values = group[attr_name].dropna().unique().tolist()
-                if values:
-                    # Clean values and remove empty strings
-                    cleaned_values = [str(value).strip() for value in values if str(value).strip()]
-                    if cleaned_values:
-                        singular_name = plural_to_singular.get(attr_name, attr_name)
-                        variable_attributes[attr_name] = {
-                            "name": singular_name,
-                            "options": list(set(cleaned_values)),
-                            "visible": True,
-                            "variation": True
-                        }
-
-        # Add variable attributes to the parent product
-        attributes.extend(variable_attributes.values())
-
-        # Add variable attributes to the variations
-        parent_product['attributes'] = attributes
+        image_urls = image_urls_by_row[group.index[0]]
+        if image_urls:
+            parent_product["images"] = [{"src": url.strip()} for url in image_urls.split(',') if url.strip()]
 
         # Variations
-        variations = []
-        for index, row in group.iterrows():
-            variation = {
-                "regular_price": str(row['Precio']),
-                "sku": row['SKU'],
-                "attributes": [],
-                "manage_stock": True,
-                "stock_quantity": int(row['Stock:Mundo Bikes']) if 'Stock:Mundo Bikes' in row and not pd.isna(row['Stock:Mundo Bikes']) else 0,
-                "images": []
-            }
-
-            # Process images using the process_image_urls function
-            # variation_image_urls = process_image_urls(row['Imagenes Ailoo'], row['Id'])
-            # if variation_image_urls:
-            #     # Use the first image as the variation image
-            #     variation_image_url = variation_image_urls.split(',')[0]
-            #     variation["image"] = {"src": variation_image_url.strip()}
-
-            # Add variation attributes
-            for attr_name in ['Tamaños', 'Colores']:
-                if attr_name in row and pd.notna(row[attr_name]) and str(row[attr_name]).strip():
-                    singular_name = plural_to_singular.get(attr_name, attr_name)
-                    variation['attributes'].append({
-                        "name": singular_name,
-                        "option": str(row[attr_name]).strip()
-                    })
-
-            variations.append(variation)
+        variations = [build_variation(row, image_urls_by_row[index]) for index, row in group.iterrows()]
 
         products.append({
             "parent": parent_product,
@@ -282,243 +345,95 @@ def format_variable_products(df_variable):
     return products
 
 
-def format_updated_simple_products(df_simple, sku_to_id, category_name_to_id):
-    products = []
-    for index, row in df_simple.iterrows():
-
-        product_id = sku_to_id.get(row['SKU'])
-
-        if not product_id:
-            continue # Cannot update a product that doesn't exist
-
-        # Get category IDs
-        categories = []
-        primary_category = str(row['Categoria Primaria']).strip()
-        parent_category = str(row['Categoría Padre']).strip()
-        if primary_category and primary_category in category_name_to_id:
-            categories.append({"id": category_name_to_id[primary_category]})
-        if parent_category and parent_category in category_name_to_id:
-            categories.append({"id": category_name_to_id[parent_category]})
-
-        product = {
-            "id": product_id,
-            "name": row['Producto'],
-            "regular_price": str(row['Precio']),
-            "sku": row['SKU'],
-            "categories": categories,
-            # "tags": [{"name": tag.strip()} for tag in str(row['Etiquetas']).split(',') if tag.strip()],
-            "manage_stock": True,
-            "stock_quantity": int(row['Stock:Mundo Bikes']) if 'Stock:Mundo Bikes' in row and not pd.isna(row['Stock:Mundo Bikes']) else 0,
-            "backorders": "no",
-        }
-
-        # Process images using the process_image_urls function
-        image_urls = process_image_urls(row['Imagenes Ailoo'], row['Id'])
-        if image_urls:
-            product["images"] = [{"src": url.strip()} for url in image_urls.split(',') if url.strip()]
-
-        # Update custom fields as attributes
-        attributes = []
-
-        # Brand
-        if 'Marca' in row and not pd.isna(row['Marca']) and row['Marca'].strip():
-            attributes.append({
-                "name": "Marca",
-                "options": [row['Marca']],
-                "visible": True,
-                "variation": False
-            })
-
-        # Model
-        if 'Modelo' in row and not pd.isna(row['Modelo']) and row['Modelo'].strip():
-            attributes.append({
-                "name": "Modelo",
-                "options": [row['Modelo']],
-                "visible": True,
-                "variation": False
-            })
-
-        # Sizes
-        if 'Tamaños' in row and not pd.isna(row['Tamaños']) and row['Tamaños'].strip():
-            tamanos = [size.strip() for size in str(row['Tamaños']).split(',') if size.strip()]
-            attributes.append({
-                "name": "Tamaño",
-                "options": tamanos,
-                "visible": True,
-                "variation": False
-            })
-
-        # Colors
-        if 'Colores' in row and not pd.isna(row['Colores']) and row['Colores'].strip():
-            colores = [color.strip() for color in str(row['Colores']).split(',') if color.strip()]
-            attributes.append({
-                "name": "Color",
-                "options": colores,
-                "visible": True,
-                "variation": False
-            })
+def format_updated_simple_products(df_simple, sku_to_id, row_category_ids):
+    return build_simple_product_payloads(df_simple, row_category_ids, sku_to_id)
 
-        # Proveedor
-        attributes.append({ "name": "Proveedor", "options": "Alioo", "visible": False, "variation": False })
 
-        # Getting product item id from alioo
-        product_item_id = get_product_item_id(row['SKU'])
-
-        if not product_item_id:
-            logging.warning(f"Product with SKU '{row['SKU']}' not found in Alioo.")
-            continue
-
-        # Alioo ID
-        attributes.append({ "name": "Alioo ID", "options": product_item_id, "visible": False, "variation": False })
-
-        if attributes:
-            product['attributes'] = attributes
-
-
-        products.append(product)
-    return products
 
+def format_updated_variable_products(df_variable, sku_to_id, row_category_ids, wcapi, use_local_state=False):
+    """
+    Build the updates of variable products and their variations. With
+    use_local_state the existing variations come from the local product state
+    instead of WooCommerce.
+    """
+    products = []
 
+    # Resolve the images of every variation up front
+    image_urls_by_row = resolve_dataframe_images(df_variable)
 
-def format_updated_variable_products(df_variable, sku_to_id, category_name_to_id, wcapi):
-    products = []
-    # Group by 'Id' to process each variable product
+    # Find the WooCommerce ID of every parent
+    parent_ids = {}
     grouped = df_variable.groupby('Id')
     for product_id, group in grouped:
-        first_row = group.iloc[0]
-        parent_sku = first_row['SKU']
+        parent_sku = get_parent_sku(product_id)
         parent_id = sku_to_id.get(parent_sku)
         if not parent_id:
             logging.warning(f"Parent product with SKU '{parent_sku}' not found in WooCommerce.")
             continue
+        parent_ids[product_id] = parent_id
 
-        # Get category IDs
-        categories = []
-        primary_category = str(first_row['Categoria Primaria']).strip()
-        parent_category = str(first_row['Categoría Padre']).strip()
-        if primary_category and primary_category in category_name_to_id:
-            categories.append({"id": category_name_to_id[primary_category]})
-        if parent_category and parent_category in category_name_to_id:
-            categories.append({"id": category_name_to_id[parent_category]})
+    if use_local_state:
+        variations_by_parent = get_stored_variations(parent_ids.values())
+    else:
+        # Fetch the existing variations of every parent concurrently
+        variations_by_parent = get_variations_for_products(wcapi, parent_ids.values())
+
+    # Group by 'Id' to process each variable product
+    for product_id, group in grouped:
+        if product_id not in parent_ids:
+            continue
+        parent_id = parent_ids[product_id]
+        first_row = group.iloc[0]
 
         # Prepare parent product data for update
         parent_product = {
             "id": parent_id,
             "name": first_row['Producto'],
             "type": "variable",
+            "sku": get_parent_sku(product_id),
             "description": first_row['Descripción'] if 'Descripción' in first_row and not pd.isna(first_row['Descripción']) else '',
-            "categories": categories,
+            "categories": [{"id": category_id} for category_id in row_category_ids.get(group.index[0], [])],
             # "tags": [{"name": tag.strip()} for tag in str(first_row['Etiquetas']).split(',') if tag.strip()],
+            "attributes": build_variable_parent_attributes(first_row, group),
         }
 
-        # Process images using the process_image_urls function
-        image_urls = process_image_urls(first_row['Imagenes Ailoo'], first_row['Id'])
+        image_urls = image_urls_by_row[group.index[0]]
         if image_urls:
             parent_product["images"] = [{"src": url.strip()} for url in image_urls.split(',') if url.strip()]
 
-        # Update attributes
-        attributes = []
-
-        # Brand
-        if 'Marca' in first_row and not pd.isna(first_row['Marca']) and first_row['Marca'].strip():
-            attributes.append({
-                "name": "Marca",
-                "options": [first_row['Marca']],
-                "visible": True,
-                "variation": False
-            })
-
-        # Model
-        if 'Modelo' in first_row and not pd.isna(first_row['Modelo']) and first_row['Modelo'].strip():
-            attributes.append({
-                "name": "Modelo",
-                "options": [first_row['Modelo']],
-                "visible": True,
-                "variation": False
-            })
-
-        plural_to_singular = {
-            'Tamaños': 'Tamaño',
-            'Colores': 'Color'
-        }
-
-        # Variable attributes
-        variable_attributes = {}
-        for attr_name in ['Tamaños', 'Colores']:
-            if attr_name in group.columns:
-                values = group[attr_name].dropna().unique().tolist()
-                if values:
-                    cleaned_values = [str(value).strip() for value in values if str(value).strip()]
-                    if cleaned_values:
-                        singular_name = plural_to_singular.get(attr_name, attr_name)
-                        variable_attributes[attr_name] = {
-                            "name": singular_name,
-                            "options": list(set(cleaned_values)),
-                            "visible": True,
-                            "variation": True
-                        }
-
-        attributes.extend(variable_attributes.values())
-        parent_product['attributes'] = attributes
-
-        # Fetch existing variations from WooCommerce
-        existing_variations = get_variations_for_product(wcapi, parent_id)
-        variation_sku_to_id = map_variation_sku_to_id(existing_variations)
+        # Existing variations from WooCommerce
+        existing_variations = {variation['sku']: variation for variation in variations_by_parent[parent_id] if variation.get('sku')}
+        if existing_variations and not use_local_state:
+            forget_missing_variations(parent_id, [variation['id'] for variation in existing_variations.values()])
 
         # Variations to update or create
         variations_to_update = []
         variations_to_create = []
 
-        # SKUs of variations in Excel
-        excel_variation_skus = set()
-
         for index, row in group.iterrows():
-            variation_sku = row['SKU']
-            excel_variation_skus.add(variation_sku)
-            variation_data = {
-                "sku": variation_sku,
-                "regular_price": str(row['Precio']),
-                "manage_stock": True,
-                "stock_quantity": int(row['Stock:Mundo Bikes']) if 'Stock:Mundo Bikes' in row and not pd.isna(row['Stock:Mundo Bikes']) else 0,
-                "attributes": []
-            }
-
-            # Process images
-            variation_image_urls = process_image_urls(row['Imagenes Ailoo'], row['Id'])
-            if variation_image_urls:
-                variation_image_url = variation_image_urls.split(',')[0]
-                variation_data["image"] = {"src": variation_image_url.strip()}
-
-            # Add variation attributes
-            for attr_name in ['Tamaños', 'Colores']:
-                if attr_name in row and pd.notna(row[attr_name]) and str(row[attr_name]).strip():
-                    singular_name = plural_to_singular.get(attr_name, attr_name)
-                    variation_data['attributes'].append({
-                        "name": singular_name,
-                        "option": str(row[attr_name]).strip()
-                    })
-
-            # Check if variation exists
-            variation_id = variation_sku_to_id.get(variation_sku)
-            if variation_id:
-                variation_data['id'] = variation_id
+            variation_data = build_variation(row, image_urls_by_row[index])
+
+            # Check if variation exists, and only update it if it changed
+            existing_variation = existing_variations.get(variation_data['sku'])
+            if not existing_variation:
+                variations_to_create.append(variation_data)
+            elif is_changed(variation_data, existing_variation, VARIATION_DIFF_FIELDS):
+                variation_data['id'] = existing_variation['id']
                 variations_to_update.append(variation_data)
             else:
-                variations_to_create.append(variation_data)
+                record_variation(variation_data, parent_id, existing_variation['id'])
 
         # Variations to delete (existing variations not in Excel)
-        existing_variation_skus = set(variation_sku_to_id.keys())
-        skus_to_delete = existing_variation_skus - excel_variation_skus
-        variations_to_delete = [variation_sku_to_id[sku] for sku in skus_to_delete]
+        skus_to_delete = set(existing_variations) - set(group['SKU'])
+        variations_to_delete = [existing_variations[sku]['id'] for sku in skus_to_delete]
 
         products.append({
             "parent": parent_product,
             "variations_to_update": variations_to_update,
             "variations_to_create": variations_to_create,
             "variations_to_delete": variations_to_delete,
-            "parent_id": parent_id
+            "parent_id": parent_id,
+            "parent_sku": parent_product['sku']
         })
 
     return products
-
-
@@ -0,0 +1,234 @@
+import hashlib
+import html
+import json
+import logging
+import os
+import re
+from urllib.parse import urlparse
+
+import pandas as pd
+
+# Fields of the WooCommerce payloads that are compared against the snapshot
+DIFF_FIELDS = ['name', 'regular_price', 'stock_quantity', 'categories', 'attributes', 'images']
+
+# Fields of the variation payloads that are compared against the existing variations
+VARIATION_DIFF_FIELDS = ['regular_price', 'stock_quantity', 'attributes', 'image']
+
+# Fields the local product state keeps as values instead of in the payload hash,
+# so the stock sync can update them alone
+STOCK_FIELDS = ['regular_price', 'stock_quantity']
+
+# Sub-fields the diff reads from the nested objects of the snapshot
+DIFF_SUBFIELDS = {
+    'categories': ['id'],
+    'attributes': ['name', 'options'],
+    'images': ['id', 'src'],
+}
+
+# Fields requested when snapshotting the WooCommerce catalog: identifiers plus what the diff compares
+SNAPSHOT_FIELDS = ['id', 'sku', 'type'] + [
+    f"{field}.{subfield}" if field in DIFF_SUBFIELDS else field
+    for field in DIFF_FIELDS
+    for subfield in DIFF_SUBFIELDS.get(field, [None])
+]
+
+# Fields requested when fetching the existing variations of a product
+VARIATION_SNAPSHOT_FIELDS = [
+    'id', 'sku', 'regular_price', 'stock_quantity', 'attributes.name', 'attributes.option', 'image.id', 'image.src'
+]
+
+# Suffixes WordPress appends to sideloaded files (duplicates, resized copies, big images)
+WP_FILENAME_SUFFIX = re.compile(r'(-\d+x\d+|-scaled|-\d+)+$')
+
+
+def _is_missing(value):
+    if isinstance(value, (list, tuple, dict, set)):
+        return False
+    return value is None or pd.isna(value)
+
+
+def normalize_name(value):
+    if _is_missing(value):
+        return ''
+    return html.unescape(str(value)).strip()
+
+
+def normalize_price(value):
+    if _is_missing(value) or str(value).strip() == '':
+        return None
+    try:
+        return round(float(value), 2)
+    except (TypeError, ValueError):
+        return str(value).strip()
+
+
+def normalize_stock(value):
+    if _is_missing(value) or str(value).strip() == '':
+        return None
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def normalize_categories(categories):
+    if _is_missing(categories):
+        return frozenset()
+    return frozenset(int(category['id']) for category in categories if category.get('id'))
+
+
+def normalize_attributes(attributes):
+    if _is_missing(attributes):
+        return {}
+    normalized = {}
+    for attribute in attributes:
+        # Variations hold a single 'option'
+        options = attribute.get('options', attribute.get('option', []))
+        if not isinstance(options, (list, tuple)):
+            options = [options]
+        normalized[normalize_name(attribute.get('name'))] = tuple(sorted(normalize_name(option) for option in options))
+    return normalized
+
+
+def image_key(src):
+    """
+    Reduce an image URL to a key that survives the WordPress sideload, which
+    renames 'abc_900.jpg' to e.g. '.../uploads/2024/05/abc_900-1.jpg'.
+    """
+    filename = os.path.basename(urlparse(str(src)).path)
+    stem, _ = os.path.splitext(filename)
+    return WP_FILENAME_SUFFIX.sub('', stem).lower()
+
+
+def normalize_images(images):
+    if _is_missing(images):
+        return ()
+    return tuple(image_key(image['src']) for image in images if image.get('src'))
+
+
+def normalize_image(image):
+    if _is_missing(image) or not image:
+        return ()
+    return normalize_images([image])
+
+
+NORMALIZERS = {
+    'name': normalize_name,
+    'regular_price': normalize_price,
+    'stock_quantity': normalize_stock,
+    'categories': normalize_categories,
+    'attributes': normalize_attributes,
+    'images': normalize_images,
+    'image': normalize_image,
+}
+
+
+def get_changed_fields(product, wc_product, fields=DIFF_FIELDS):
+    """
+    Return the fields of the payload that differ from the WooCommerce snapshot.
+    Only fields present in the payload are compared.
+    """
+    changed_fields = []
+    for field in fields:
+        if field not in product:
+            continue
+        normalize = NORMALIZERS[field]
+        if normalize(product[field]) != normalize(wc_product.get(field)):
+            changed_fields.append(field)
+    return changed_fields
+
+
+def _canonical(value):
+    if isinstance(value, dict):
+        return sorted((str(key), _canonical(item)) for key, item in value.items())
+    if isinstance(value, (set, frozenset)):
+        return sorted(_canonical(item) for item in value)
+    if isinstance(value, (list, tuple)):
+        return [_canonical(item) for item in value]
+    return value
+
+
+def payload_hash(payload, fields=DIFF_FIELDS):
+    """
+    Hash the fields of a payload the diff compares, but the STOCK_FIELDS,
+    normalized the same way, so create and update payloads of the same product
+    hash alike.
+    """
+    normalized = {
+        field: _canonical(NORMALIZERS[field](payload[field]))
+        for field in fields if field in payload and field not in STOCK_FIELDS
+    }
+    return hashlib.sha1(json.dumps(normalized, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def is_changed(payload, existing, fields=DIFF_FIELDS):
+    """
+    Compare a payload with an existing product or variation. Entries of the
+    local product state carry the hash of the last payload written instead
+    of the fields themselves, but for the STOCK_FIELDS.
+    """
+    if 'hash' in existing:
+        if _is_missing(existing['hash']) or existing['hash'] != payload_hash(payload, fields):
+            return True
+        fields = STOCK_FIELDS
+    return bool(get_changed_fields(payload, existing, fields))
+
+
+def index_products_by_sku(df_wc):
+    if df_wc.empty or 'sku' not in df_wc.columns:
+        return {}
+    df_indexed = df_wc[df_wc['sku'].astype(str).str.strip() != '']
+    df_indexed = df_indexed.drop_duplicates(subset=['sku']).set_index('sku')
+    return df_indexed.to_dict('index')
+
+
+def filter_changed_products(products, df_wc, on_unchanged=None):
+    """
+    Keep only the payloads that differ from their WooCommerce snapshot, or
+    from the hash of the last payload written when df_wc is the local state.
+    Payloads whose SKU is not in the snapshot are always kept.
+    on_unchanged is called with each payload dropped and its product ID.
+    """
+    wc_products = index_products_by_sku(df_wc)
+    changed_products = []
+    for product in products:
+        wc_product = wc_products.get(product.get('sku'))
+        if wc_product is None:
+            changed_products.append(product)
+            continue
+
+        if 'hash' in wc_product:
+            if is_changed(product, wc_product):
+                logging.info(f"Product with SKU '{product['sku']}' changed since it was last written.")
+                changed_products.append(product)
+            elif on_unchanged:
+                on_unchanged(product, wc_product['id'])
+            continue
+
+        changed_fields = get_changed_fields(product, wc_product)
+        if changed_fields:
+            logging.info(f"Product with SKU '{product['sku']}' changed: {', '.join(changed_fields)}")
+            changed_products.append(product)
+        elif on_unchanged:
+            on_unchanged(product, wc_product['id'])
+
+    logging.info(f"{len(changed_products)} of {len(products)} products have changes.")
+    return changed_products
+
+
+def filter_changed_variable_products(products, df_wc, on_unchanged=None):
+    """
+    Drop the parent payloads that match their WooCommerce snapshot (leaving
+    parent as None), and the products left with nothing to write.
+    """
+    parents = [item['parent'] for item in products]
+    changed_parent_skus = {parent['sku'] for parent in filter_changed_products(parents, df_wc, on_unchanged)}
+    changed_products = []
+    for item in products:
+        if item['parent']['sku'] not in changed_parent_skus:
+            item['parent'] = None
+        if item['parent'] or item['variations_to_create'] or item['variations_to_update'] or item['variations_to_delete']:
+            changed_products.append(item)
+
+    logging.info(f"{len(changed_products)} of {len(products)} variable products have changes.")
+    return changed_products
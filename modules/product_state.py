@@ -0,0 +1,173 @@
+import logging
+import threading
+import time
+
+import pandas as pd
+
+from config.settings import PRODUCT_STATE_PATH, PRODUCT_STATE_RECONCILE_HOURS
+from .local_store import load_json, save_json
+from .product_diff import NORMALIZERS, DIFF_FIELDS, VARIATION_DIFF_FIELDS, STOCK_FIELDS, payload_hash
+
+# What was last written to WooCommerce for each SKU:
+# {"reconciled_at": float, "products": {sku: {"id", "parent_id", "type", "hash", "regular_price", "stock_quantity"}}}
+# Variations are stored by their own SKU, with the ID of their parent in parent_id.
+_state = None
+_state_lock = threading.Lock()
+
+
+def _get_state():
+    global _state
+    if _state is None:
+        _state = load_json(PRODUCT_STATE_PATH, {})
+        _state.setdefault('reconciled_at', 0)
+        _state.setdefault('products', {})
+    return _state
+
+
+def _record(payload, fields, product_id, **extra):
+    """
+    Merge what payload wrote into the entry of its SKU. Payloads of the stock
+    sync only carry the STOCK_FIELDS and leave the hash as it was.
+    """
+    with _state_lock:
+        products = _get_state()['products']
+        entry = products.get(payload['sku'], {"hash": None, "regular_price": None, "stock_quantity": None})
+        entry.update(extra, id=int(product_id))
+        if any(field in payload for field in fields if field not in STOCK_FIELDS):
+            entry['hash'] = payload_hash(payload, fields)
+        for field in STOCK_FIELDS:
+            if field in payload:
+                entry[field] = NORMALIZERS[field](payload[field])
+        products[payload['sku']] = entry
+
+
+def record_product(payload, product_id):
+    """
+    Remember a product payload WooCommerce now holds, under its SKU.
+    """
+    extra = {"type": payload['type']} if 'type' in payload else {}
+    _record(payload, DIFF_FIELDS, product_id, **extra)
+
+
+def record_variation(payload, parent_id, variation_id):
+    _record(payload, VARIATION_DIFF_FIELDS, variation_id, parent_id=int(parent_id))
+
+
+def rename_product(old_sku, new_sku):
+    """
+    Move the entry of a product to its new SKU.
+    """
+    with _state_lock:
+        products = _get_state()['products']
+        entry = products.pop(old_sku, None)
+        if entry is not None:
+            products[new_sku] = entry
+
+
+def forget_products(product_ids):
+    """
+    Drop the deleted products, or variations, and the variations of deleted products.
+    """
+    product_ids = {int(product_id) for product_id in product_ids}
+    with _state_lock:
+        products = _get_state()['products']
+        for sku in [sku for sku, entry in products.items() if entry['id'] in product_ids or entry.get('parent_id') in product_ids]:
+            del products[sku]
+
+
+def needs_reconciliation():
+    """
+    True when the local state is empty or older than PRODUCT_STATE_RECONCILE_HOURS,
+    so the run must read the whole catalog from WooCommerce.
+    """
+    state = _get_state()
+    return not state['products'] or time.time() - state['reconciled_at'] > PRODUCT_STATE_RECONCILE_HOURS * 3600
+
+
+def reconcile_product_state(df_wc):
+    """
+    Align the local state with a full WooCommerce snapshot. Products missing
+    from WooCommerce are dropped with their variations, IDs are taken from the
+    snapshot, and products the state doesn't know yet are added without hash,
+    so the next write records it.
+    """
+    wc_products = df_wc.drop_duplicates(subset=['sku']).set_index('sku').to_dict('index') if not df_wc.empty else {}
+    with _state_lock:
+        state = _get_state()
+        products = state['products']
+        for sku in [sku for sku, entry in products.items() if entry.get('parent_id') is None and sku not in wc_products]:
+            del products[sku]
+        for sku, wc_product in wc_products.items():
+            if not sku:
+                continue
+            entry = products.get(sku)
+            if entry is None or entry.get('parent_id') is not None:
+                products[sku] = {
+                    "id": int(wc_product['id']),
+                    "hash": None,
+                    "type": str(wc_product.get('type', 'simple')),
+                    "regular_price": NORMALIZERS['regular_price'](wc_product.get('regular_price')),
+                    "stock_quantity": NORMALIZERS['stock_quantity'](wc_product.get('stock_quantity')),
+                }
+            else:
+                entry['id'] = int(wc_product['id'])
+        parent_ids = {entry['id'] for entry in products.values() if entry.get('parent_id') is None}
+        for sku in [sku for sku, entry in products.items() if entry.get('parent_id') not in (None, *parent_ids)]:
+            del products[sku]
+        state['reconciled_at'] = time.time()
+    logging.info(f"Reconciled the local product state with {len(wc_products)} WooCommerce products.")
+
+
+def forget_missing_variations(parent_id, variation_ids):
+    """
+    Drop the stored variations of a product that WooCommerce no longer has.
+    """
+    variation_ids = {int(variation_id) for variation_id in variation_ids}
+    with _state_lock:
+        products = _get_state()['products']
+        for sku in [sku for sku, entry in products.items() if entry.get('parent_id') == int(parent_id) and entry['id'] not in variation_ids]:
+            del products[sku]
+
+
+def get_local_snapshot():
+    """
+    Return the products of the local state shaped like the WooCommerce snapshot
+    (id, sku, type, regular_price, stock_quantity), plus the hash of their last
+    written payload.
+    """
+    columns = ['id', 'sku', 'type', 'hash', *STOCK_FIELDS]
+    # Writer threads update the state while the formatters read it
+    with _state_lock:
+        records = [
+            {"sku": sku, "type": 'simple', **entry}
+            for sku, entry in _get_state()['products'].items() if entry.get('parent_id') is None
+        ]
+    return pd.DataFrame(records, columns=columns)
+
+
+def get_stored_products():
+    """
+    Return a copy of the state of every SKU, products and variations: {sku: entry}.
+    """
+    with _state_lock:
+        return dict(_get_state()['products'])
+
+
+def get_stored_variations(parent_ids):
+    """
+    Return {parent_id: variations} from the local state, shaped like the
+    variations fetched from WooCommerce plus the hash of their last payload.
+    """
+    variations_by_parent = {int(parent_id): [] for parent_id in parent_ids}
+    with _state_lock:
+        for sku, entry in _get_state()['products'].items():
+            if entry.get('parent_id') in variations_by_parent:
+                variations_by_parent[entry['parent_id']].append({"sku": sku, **entry})
+    return variations_by_parent
+
+
+def save_product_state():
+    if _state is not None:
+        with _state_lock:
+            save_json(PRODUCT_STATE_PATH, _state)
+        logging.info(f"Saved the state of {len(_state['products'])} products to '{PRODUCT_STATE_PATH}'.")
@@ -1,13 +1,79 @@
+import os
+
+import numpy as np
 import pandas as pd
 import logging
 
+from config.settings import EXCEL_CACHE_DIR
+from .alioo.excel_download import excel_content_hash
+
+# Optional: calamine parses .xlsx files several times faster than openpyxl
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = 'calamine'
+except ImportError:
+    EXCEL_ENGINE = 'openpyxl'
+
+# Optional: pyarrow enables the Parquet cache of parsed Excel files
+try:
+    import pyarrow  # noqa: F401
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+# Columns used by the pipeline. Text columns are read as strings; the rest keep
+# the inferred type, so prices keep their integer format in the payloads.
+TEXT_COLUMNS = [
+    'SKU', 'Producto', 'Categoria Primaria', 'Categoría Padre', 'Marca', 'Modelo',
+    'Tamaños', 'Colores', 'Imagenes Ailoo', 'Descripción'
+]
+EXCEL_COLUMNS = TEXT_COLUMNS + ['Id', 'Precio', 'Stock:Mundo Bikes']
+
+
+def _read_cached_excel(cache_path):
+    df = pd.read_parquet(cache_path)
+    # Parquet brings missing text back as None; the pipeline expects NaN
+    return df.where(df.notna(), np.nan)
+
+
+def _write_cached_excel(df, cache_path):
+    os.makedirs(EXCEL_CACHE_DIR, exist_ok=True)
+    # Keep only the cache of the latest file
+    for filename in os.listdir(EXCEL_CACHE_DIR):
+        if filename.startswith('excel_') and filename.endswith('.parquet'):
+            os.remove(os.path.join(EXCEL_CACHE_DIR, filename))
+    df.to_parquet(cache_path, index=False)
+
+
 def read_excel(excel_path):
     try:
-        df = pd.read_excel(excel_path, engine='openpyxl', dtype={'SKU': str})
+        cache_path = None
+        if PARQUET_AVAILABLE:
+            cache_path = os.path.join(EXCEL_CACHE_DIR, f"excel_{excel_content_hash(excel_path)}.parquet")
+            if os.path.exists(cache_path):
+                df = _read_cached_excel(cache_path)
+                logging.info(f"File '{excel_path}' loaded from cache '{cache_path}'.")
+                return df
+
+        df = pd.read_excel(
+            excel_path,
+            engine=EXCEL_ENGINE,
+            usecols=lambda column: column in EXCEL_COLUMNS,
+            dtype={column: str for column in TEXT_COLUMNS}
+        )
+
+        logging.info(f"File '{excel_path}' read successfully with {EXCEL_ENGINE}.")
 
-        logging.info(f"File '{excel_path}' read successfully.")
+        if cache_path:
+            # The cache is only an optimization, a file it can't store is still read
+            try:
+                _write_cached_excel(df, cache_path)
+            except Exception as e:
+                logging.warning(f"Could not cache '{excel_path}' in '{cache_path}': {e}")
+                if os.path.exists(cache_path):
+                    os.remove(cache_path)
 
         return df
     except Exception as e:
         logging.error(f" Error reading file '{excel_path}': {e}")
-        return
\ No newline at end of file
+        return
@@ -0,0 +1,141 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+from config.settings import RUN_JOURNAL_PATH
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at REAL NOT NULL,
+    finished_at REAL,
+    status TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stages (
+    run_id INTEGER NOT NULL,
+    stage TEXT NOT NULL,
+    output TEXT NOT NULL,
+    saved_at REAL NOT NULL,
+    PRIMARY KEY (run_id, stage)
+);
+CREATE TABLE IF NOT EXISTS writes (
+    run_id INTEGER NOT NULL,
+    stage TEXT NOT NULL,
+    sku TEXT NOT NULL,
+    wc_id INTEGER,
+    written_at REAL NOT NULL,
+    PRIMARY KEY (run_id, stage, sku)
+);
+"""
+
+
+class RunJournal:
+    """
+    SQLite journal of a sync run: the output of each stage, and the SKUs each
+    write stage has confirmed. A run resumed from the journal skips the stages
+    and the products that were already done. Runs that were interrupted
+    ('running') or ended without writing every product ('partial') can be
+    resumed.
+    """
+
+    def __init__(self, path=RUN_JOURNAL_PATH, resume=False):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # The async engine uses the journal from its worker threads
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.executescript(SCHEMA)
+
+        last_run = self.connection.execute(
+            "SELECT id FROM runs WHERE status IN ('running', 'partial') ORDER BY id DESC LIMIT 1"
+        ).fetchone()
+        self.resumed = bool(resume and last_run)
+
+        with self.lock, self.connection:
+            if self.resumed:
+                self.run_id = last_run[0]
+                self.connection.execute("UPDATE runs SET status = 'running', finished_at = NULL WHERE id = ?", (self.run_id,))
+                logging.info(f"Resuming sync run {self.run_id} from the journal.")
+            else:
+                if resume:
+                    logging.info("No interrupted run to resume, starting a new one.")
+                # Runs left unfinished are not resumable anymore
+                self.connection.execute("UPDATE runs SET status = 'abandoned' WHERE status IN ('running', 'partial')")
+                self.run_id = self.connection.execute(
+                    "INSERT INTO runs (started_at, status) VALUES (?, 'running')", (time.time(),)
+                ).lastrowid
+                # Only the current run can be resumed, drop what older runs recorded
+                self.connection.execute("DELETE FROM stages WHERE run_id != ?", (self.run_id,))
+                self.connection.execute("DELETE FROM writes WHERE run_id != ?", (self.run_id,))
+
+    def get_stage(self, stage):
+        """
+        Return the saved output of stage, or None when it didn't finish.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT output FROM stages WHERE run_id = ? AND stage = ?", (self.run_id, stage)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_stage(self, stage, output):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO stages (run_id, stage, output, saved_at) VALUES (?, ?, ?, ?)",
+                (self.run_id, stage, json.dumps(output, ensure_ascii=False), time.time())
+            )
+
+    def get_dataframe(self, stage):
+        records = self.get_stage(stage)
+        return pd.DataFrame(records) if records is not None else None
+
+    def save_dataframe(self, stage, df):
+        # to_json turns NaN and pd.NA into null
+        self.save_stage(stage, json.loads(df.to_json(orient='records', force_ascii=False)))
+
+    def get_written(self, stage):
+        """
+        Return the SKUs stage already wrote to WooCommerce.
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT sku FROM writes WHERE run_id = ? AND stage = ?", (self.run_id, stage)
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def record_writes(self, stage, written):
+        """
+        Record the {sku: wc_id} that stage wrote successfully.
+        """
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO writes (run_id, stage, sku, wc_id, written_at) VALUES (?, ?, ?, ?, ?)",
+                [(self.run_id, stage, str(sku), int(wc_id) if wc_id is not None else None, now) for sku, wc_id in written.items()]
+            )
+
+    def skip_written(self, stage, df, skus):
+        """
+        Drop the rows of df whose product SKU (skus, aligned with df) stage
+        already wrote in this run.
+        """
+        written = self.get_written(stage)
+        if not written or df.empty:
+            return df
+        pending = ~skus.astype(str).isin(written)
+        logging.info(f"Skipping {len(df) - pending.sum()} rows already written by '{stage}'.")
+        return df[pending]
+
+    def finish(self, status='finished'):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "UPDATE runs SET status = ?, finished_at = ? WHERE id = ?", (status, time.time(), self.run_id)
+            )
+        self.connection.close()
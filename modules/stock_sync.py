@@ -0,0 +1,87 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from config.settings import wcapi, WC_MAX_WORKERS
+from .alioo.excel_download import download_excel
+from .product import pre_process_df
+from .product_diff import NORMALIZERS, STOCK_FIELDS
+from .product_state import get_stored_products
+from .woocommerce_api import update_products, write_variations_batch
+from .metrics import stage_timer
+from .sync_stages import read_excel_stage
+
+
+def build_stock_updates(df_excel, stored_products):
+    """
+    Compare the price and stock of every Excel row with the local product
+    state. Returns the minimal updates of simple products, and of variations
+    grouped by parent ID: {"id", "sku", "regular_price", "stock_quantity"}.
+    Rows whose SKU the state doesn't know are left to the full sync.
+    """
+    skus = df_excel['SKU'].astype(str).tolist()
+    prices = df_excel['Precio'].astype(str).tolist()
+    if 'Stock:Mundo Bikes' in df_excel.columns:
+        stocks = pd.to_numeric(df_excel['Stock:Mundo Bikes'], errors='coerce').fillna(0).astype(int).tolist()
+    else:
+        stocks = [0] * len(df_excel)
+
+    product_updates = []
+    variation_updates = {}
+    unknown = 0
+    for sku, price, stock in zip(skus, prices, stocks):
+        entry = stored_products.get(sku)
+        if entry is None:
+            unknown += 1
+            continue
+        update = {"id": entry['id'], "sku": sku, "regular_price": price, "stock_quantity": stock}
+        if all(NORMALIZERS[field](update[field]) == entry.get(field) for field in STOCK_FIELDS):
+            continue
+        if entry.get('parent_id') is None:
+            product_updates.append(update)
+        else:
+            variation_updates.setdefault(entry['parent_id'], []).append(update)
+
+    if unknown:
+        logging.info(f"{unknown} SKUs are not in the local product state yet, the full sync will create them.")
+    return product_updates, variation_updates
+
+
+def run_stock_sync(excel_path, force=False):
+    """
+    Push only the price and stock changes of the Excel file to WooCommerce,
+    diffing against the local product state. Images, Ailoo IDs and categories
+    are not touched, so it is cheap enough to run every few minutes.
+    """
+    # The Excel state is left for the full sync, which still has to process this file
+    with stage_timer('download'):
+        excel_changed, _ = download_excel(excel_path)
+    if not excel_changed and not force:
+        logging.info("Excel file unchanged since the last full sync, no stock to update.")
+        return
+
+    stored_products = get_stored_products()
+    if not stored_products:
+        logging.warning("The local product state is empty, run a full sync first.")
+        return
+
+    df_excel = pre_process_df(read_excel_stage(excel_path))
+    with stage_timer('identify'):
+        product_updates, variation_updates = build_stock_updates(df_excel, stored_products)
+    logging.info(
+        f"Stock sync: {len(product_updates)} products and "
+        f"{sum(len(updates) for updates in variation_updates.values())} variations changed price or stock."
+    )
+
+    with stage_timer('update_simple'):
+        updated_skus = update_products(wcapi, product_updates)
+    logging.info(f"Updated the price and stock of {len(updated_skus)} of {len(product_updates)} products.")
+
+    # Each product's variations go in a single request, several products at a time
+    with stage_timer('update_variable'), ThreadPoolExecutor(max_workers=WC_MAX_WORKERS) as executor:
+        written = sum(executor.map(
+            lambda parent_id: write_variations_batch(wcapi, parent_id, update=variation_updates[parent_id]),
+            variation_updates
+        ))
+    logging.info(f"Updated the price and stock of {written} variations.")
@@ -0,0 +1,171 @@
+import logging
+
+from config.settings import wcapi
+from .alioo.excel_download import download_excel, save_excel_state
+from .read_excel import read_excel
+from .metrics import stage_timer
+from .product_state import record_product, save_product_state
+from .dataframe_operations import get_unique_categories, get_category_parents, get_row_category_ids
+from .product import pre_process_df, migrate_legacy_parent_skus, identify_products, separate_simple_and_variable, map_sku_to_id, get_product_skus
+from .product import format_simple_products, format_updated_simple_products, format_variable_products, format_updated_variable_products
+from .product_diff import filter_changed_products, filter_changed_variable_products
+from .woocommerce_api import get_products_snapshot, get_all_woocommerce_categories, create_missing_categories, compact_product_dtypes
+from .woocommerce_api import create_simple_products, update_products, create_variable_products, update_variable_products, delete_products_batch
+
+
+def download_stage(journal, excel_path, force=False):
+    """
+    Download the Excel file. Returns (changed, excel_state); changed is False
+    when the file didn't change since the last successful run and the run can
+    be skipped. A resumed run takes the state from the journal.
+    """
+    excel_state = journal.get_stage('download')
+    if excel_state is not None:
+        return True, excel_state
+    with stage_timer('download'):
+        excel_changed, excel_state = download_excel(excel_path)
+    if not excel_changed and not force:
+        return False, excel_state
+    journal.save_stage('download', excel_state)
+    return True, excel_state
+
+
+def read_excel_stage(excel_path):
+    with stage_timer('read_excel'):
+        df_excel = read_excel(excel_path)
+    if df_excel is None:
+        raise Exception(f"Could not read the Excel file '{excel_path}'.")
+    return df_excel
+
+
+def snapshot_stage(journal, reconcile=False):
+    """
+    Return the products to diff against, as they were when the run started.
+    """
+    df_wc = journal.get_dataframe('snapshot')
+    if df_wc is not None:
+        return compact_product_dtypes(df_wc)
+    with stage_timer('snapshot'):
+        df_wc = get_products_snapshot(wcapi, reconcile)
+    journal.save_dataframe('snapshot', df_wc)
+    return df_wc
+
+
+def categories_stage(journal, df_excel, category_names):
+    """
+    Return the WooCommerce category IDs by name, creating the missing ones
+    linked to their parent category.
+    """
+    category_name_to_id = journal.get_stage('categories')
+    if category_name_to_id is not None:
+        return category_name_to_id
+    with stage_timer('categories'):
+        category_name_to_id = get_all_woocommerce_categories(wcapi)
+        category_parents = get_category_parents(df_excel)
+        category_name_to_id = create_missing_categories(wcapi, category_names, category_name_to_id, category_parents)
+    journal.save_stage('categories', category_name_to_id)
+    return category_name_to_id
+
+
+def plan_writes(journal, df_excel, df_wc):
+    """
+    Identify the products to create, update and delete. Returns the write
+    stages, as (stage, df, format_chunk, write_batch) with the rows each stage
+    still has to write, and the IDs of the products to delete.
+    """
+    df_excel = pre_process_df(df_excel)
+    # Variable products created before their SKU came from the Ailoo Id are matched by the slug of their name once
+    df_excel, df_wc = migrate_legacy_parent_skus(wcapi, df_excel, df_wc)
+
+    with stage_timer('identify'):
+        # Identify new, updated, and deleted products
+        df_new, df_updated, df_delete = identify_products(df_excel, df_wc)
+    logging.info(f"Found {len(df_new)} new, {len(df_updated)} existing and {len(df_delete)} deleted products.")
+
+    # Extract unique categories from Excel, and the categories of each row
+    category_names, row_categories = get_unique_categories(df_excel)
+    category_name_to_id = categories_stage(journal, df_excel, category_names)
+    row_category_ids = get_row_category_ids(row_categories, category_name_to_id)
+
+    sku_to_id = map_sku_to_id(df_wc) if not df_wc.empty else {}
+    # The local state snapshot holds the hash of the last payload written
+    use_local_state = 'hash' in df_wc.columns
+    df_new_simple, df_new_variable = separate_simple_and_variable(df_new)
+    df_updated_simple, df_updated_variable = separate_simple_and_variable(df_updated)
+
+    if not df_new.empty:
+        # Export df_new_simple to a new Excel file
+        df_new_simple.to_excel('data/new_simple_products.xlsx', index=False)
+
+    stages = [
+        (
+            'create_simple',
+            df_new_simple,
+            lambda chunk: format_simple_products(chunk, row_category_ids),
+            lambda products: create_simple_products(wcapi, products)
+        ),
+        (
+            'create_variable',
+            df_new_variable,
+            lambda chunk: format_variable_products(chunk, row_category_ids),
+            lambda products: create_variable_products(wcapi, products)
+        ),
+        (
+            # Keep only the simple products that differ from WooCommerce
+            'update_simple',
+            df_updated_simple,
+            lambda chunk: filter_changed_products(format_updated_simple_products(chunk, sku_to_id, row_category_ids), df_wc, record_product),
+            lambda products: update_products(wcapi, products)
+        ),
+        (
+            # Create, update and delete the variations of the variable products
+            'update_variable',
+            df_updated_variable,
+            lambda chunk: filter_changed_variable_products(
+                format_updated_variable_products(chunk, sku_to_id, row_category_ids, wcapi, use_local_state), df_wc, record_product
+            ),
+            lambda products: update_variable_products(wcapi, products)
+        ),
+    ]
+    # Skip the products this run already wrote
+    stages = [(stage, journal.skip_written(stage, df, get_product_skus(df)), format_chunk, write_batch)
+              for stage, df, format_chunk, write_batch in stages]
+    delete_ids = journal.skip_written('delete', df_delete, df_delete['id'])['id'].tolist() if not df_delete.empty else []
+    return stages, delete_ids
+
+
+def record_writes(journal, stage, written):
+    """
+    Record a batch of confirmed writes in the journal. The product state is
+    saved first, so an interrupted run keeps what it wrote.
+    """
+    save_product_state()
+    journal.record_writes(stage, written)
+
+
+def delete_stage(journal, product_ids):
+    """
+    Delete products in WooCommerce that are not in the Excel file.
+    """
+    with stage_timer('delete'):
+        deleted_ids = delete_products_batch(wcapi, product_ids)
+    record_writes(journal, 'delete', {product_id: product_id for product_id in deleted_ids})
+    logging.info(f"Deleted {len(deleted_ids)} of {len(product_ids)} products.")
+    return deleted_ids
+
+
+def finish_run(journal, excel_state, results):
+    """
+    End the run. results is {stage: (sent, written)}. Once every stage wrote
+    all it sent, the Excel file is remembered as processed. Otherwise the run
+    fails and its journal is left 'partial', so --resume retries only the
+    products that were not written, and the next run syncs the file again.
+    """
+    incomplete = [f"{stage} wrote {written} of {sent}" for stage, (sent, written) in results.items() if written < sent]
+    if incomplete:
+        journal.finish('partial')
+        raise Exception(f"Not every product was written to WooCommerce: {', '.join(incomplete)}.")
+
+    # Remember the Excel file as processed
+    save_excel_state(excel_state)
+    journal.finish()
@@ -1,19 +1,77 @@
+import html
 import logging
+import time
 import pandas as pd
 import requests
+from concurrent.futures import ThreadPoolExecutor
 
-def get_all_woocommerce_products(wcapi):
-    try:
-        products = []
-        page = 1
+from config.settings import WC_BATCH_SIZE, WC_MAX_WORKERS, CATEGORY_INDEX_PATH, CATEGORY_INDEX_TTL_HOURS
+from .local_store import load_json, save_json
+from .metrics import record_cache
+from .product_diff import SNAPSHOT_FIELDS, VARIATION_SNAPSHOT_FIELDS
+from .product_state import record_product, record_variation, forget_products
+from .product_state import needs_reconciliation, reconcile_product_state, get_local_snapshot
+from .http_session import CircuitOpenError
+from .media_index import index_product_media, index_media, index_written_media, with_media_ids, forget_media, is_invalid_image_error
+
+BATCH_ACTION_LABELS = {
+    'create': ('Created', 'creating'),
+    'update': ('Updated', 'updating'),
+    'delete': ('Deleted', 'deleting'),
+}
+
+def get_all_pages(wcapi, endpoint, params=None):
+    """
+    Fetch every page of a WooCommerce collection. The first response says how
+    many pages there are (X-WP-TotalPages), so the rest are fetched concurrently.
+    """
+    params = dict(params or {}, per_page=100)
+
+    def get_page(page):
+        response = wcapi.get(endpoint, params=dict(params, page=page))
+        if response.status_code != 200:
+            error_message = response.json().get('message', 'Unknown error')
+            raise Exception(f"Failed to fetch page {page} of '{endpoint}': {error_message}")
+        return response
+
+    first_response = get_page(1)
+    items = first_response.json()
+    total_pages = first_response.headers.get('X-WP-TotalPages')
+
+    if total_pages is None:
+        # Without pagination headers, walk the pages until an empty one
+        page = 2
         while True:
-            response = wcapi.get("products", params={"per_page": 100, "page": page})
-            data = response.json()
+            data = get_page(page).json()
             if not data:
                 break
-            products.extend(data)
+            items.extend(data)
             page += 1
-        df_wc = pd.DataFrame(products)
+        return items
+
+    with ThreadPoolExecutor(max_workers=WC_MAX_WORKERS) as executor:
+        for response in executor.map(get_page, range(2, int(total_pages) + 1)):
+            items.extend(response.json())
+
+    logging.info(f"Fetched {len(items)} items from '{endpoint}' ({total_pages} pages, {first_response.headers.get('X-WP-Total', '?')} total).")
+    return items
+
+
+def compact_product_dtypes(df_wc):
+    if 'id' in df_wc.columns:
+        df_wc['id'] = pd.to_numeric(df_wc['id'], downcast='integer')
+    if 'stock_quantity' in df_wc.columns:
+        df_wc['stock_quantity'] = pd.to_numeric(df_wc['stock_quantity'], errors='coerce').astype('Int32')
+    if 'type' in df_wc.columns:
+        df_wc['type'] = df_wc['type'].astype('category')
+    return df_wc
+
+
+def get_all_woocommerce_products(wcapi, fields=SNAPSHOT_FIELDS):
+    try:
+        # Only download the fields the pipeline uses
+        products = get_all_pages(wcapi, "products", params={"_fields": ",".join(fields)})
+        df_wc = compact_product_dtypes(pd.DataFrame(products))
 
         # Skip persistent product in woocommerce
         persistent_product_name = ['Booknetic', 'Entrada Corredor']
@@ -27,163 +85,295 @@ def get_all_woocommerce_products(wcapi):
         logging.error(f"Error fetching products from WooCommerce: {e}")
         raise
 
-def create_simple_products(wcapi, products):
-    for product in products:
-        try:
-            response = wcapi.post("products", product)
-            response_data = response.json()
-            if response.status_code in [200, 201]:
-                logging.info(f"Created simple product '{product['name']}' with SKU '{product['sku']}'")
-            else:
-                error_message = response_data.get('message', 'Unknown error')
-                logging.error(f"Failed to create simple product '{product['name']}' with SKU '{product['sku']}': {error_message}")
-                logging.info(f"Product JSON: {product}")
-        except requests.exceptions.Timeout:
-            logging.error(f"Timeout occurred while creating simple product '{product['name']}' with SKU '{product['sku']}'")
-        except Exception as e:
-            logging.error(f"Error creating simple product '{product['name']}': {e}")
-            logging.info(f"Product JSON: {product}")
+def get_products_snapshot(wcapi, reconcile=False):
+    """
+    Return the products the sync diffs against. Reconciling, or when the local
+    product state is stale, it is the full WooCommerce catalog; otherwise it is
+    the local product state, read without any request to WooCommerce.
+    """
+    if reconcile or needs_reconciliation():
+        record_cache('product_state', misses=1)
+        df_wc = get_all_woocommerce_products(wcapi)
+        reconcile_product_state(df_wc)
+        index_product_media(df_wc)
+        return df_wc
+    logging.info("Using the local product state instead of reading the WooCommerce catalog.")
+    record_cache('product_state', hits=1)
+    return get_local_snapshot()
 
 
-def create_variable_products(wcapi, products):
-    for item in products:
-        parent_product = item['parent']
-        variations = item['variations']
+def get_existing_sku_id(error):
+    """
+    Return the ID of the product or variation WooCommerce already holds under
+    the SKU of a failed create, or None for other errors.
+    """
+    if error.get('code') == 'product_invalid_sku':
+        return (error.get('data') or {}).get('resource_id')
+    return None
+
+
+def write_products_batch(wcapi, action, products, batch_size=WC_BATCH_SIZE):
+    """
+    Send products to the 'products/batch' endpoint in chunks of batch_size.
+    action is 'create' or 'update'. Returns {sku: id} of the products written
+    successfully.
+    """
+    done_label, doing_label = BATCH_ACTION_LABELS[action]
+    written_products = {}
+    for i in range(0, len(products), batch_size):
+        batch = products[i:i + batch_size]
         try:
-            # Create parent product
-            response = wcapi.post("products", parent_product)
+            # Creating twice would fail on the duplicated SKU, only updates are safe to resend.
+            # Images already in the media library are linked by ID instead of sideloaded again.
+            response = wcapi.post("products/batch", {action: [with_media_ids(product) for product in batch]}, idempotent=action != 'create')
             response_data = response.json()
-            if response.status_code == 201:
-                parent_id = response_data['id']
-                logging.info(f"Created variable product '{parent_product['name']}' with SKU '{parent_product['sku']}'")
-            else:
+            if response.status_code not in [200, 201]:
                 error_message = response_data.get('message', 'Unknown error')
-                logging.error(f"Failed to create variable product '{parent_product['name']}': {error_message}")
-                logging.info(f"Product JSON: {parent_product}")
-                continue  # No continuar con las variaciones si falla la creación del padre
-
-            # Create variations
-            for variation in variations:
-                variation_response = wcapi.post(f"products/{parent_id}/variations", variation)
-                variation_data = variation_response.json()
-                if variation_response.status_code == 201:
-                    logging.info(f"Created variation with SKU '{variation['sku']}' for product ID {parent_id}")
+                logging.error(f"Failed to {action} product batch starting at index {i}: {error_message}")
+                continue
+
+            # WooCommerce answers in the same order as the batch was sent
+            results = response_data.get(action, [])
+            for product, result in zip(batch, results):
+                sku = product.get('sku', '')
+                existing_id = get_existing_sku_id(result['error']) if action == 'create' and 'error' in result else None
+                if existing_id:
+                    # Created by an earlier attempt whose answer was lost. Without hash, the next run updates it.
+                    logging.info(f"Product with SKU '{sku}' already exists with ID {existing_id}")
+                    written_products[sku] = existing_id
+                    record_product({"sku": sku, "type": product.get('type', 'simple')}, existing_id)
+                elif 'error' in result:
+                    error_message = result['error'].get('message', 'Unknown error')
+                    logging.error(f"Failed {doing_label} product '{product.get('name', '')}' with SKU '{sku}': {error_message}")
+                    logging.info(f"Product JSON: {product}")
+                    if is_invalid_image_error(result['error']):
+                        # The attachment was deleted from the media library, sideload it again next run
+                        forget_media(product)
                 else:
-                    error_message = variation_data.get('message', 'Unknown error')
-                    logging.error(f"Failed to create variation with SKU '{variation['sku']}' for product ID {parent_id}: {error_message}")
-                    logging.info(f"Variation JSON: {variation}")
+                    logging.info(f"{done_label} product '{product.get('name', '')}' with SKU '{sku}'")
+                    written_products[sku] = result.get('id')
+                    record_product(product, result['id'])
+                    index_written_media(product, result)
+            for product in batch[len(results):]:
+                logging.error(f"No result returned for product with SKU '{product.get('sku', '')}'")
+        except CircuitOpenError:
+            # WooCommerce is down, stop the run instead of dropping the remaining batches
+            raise
         except requests.exceptions.Timeout:
-            logging.error(f"Timeout occurred while creating variable product '{parent_product['name']}'")
+            logging.error(f"Timeout occurred while {doing_label} product batch starting at index {i}")
         except Exception as e:
-            logging.error(f"Error creating variable product '{parent_product['name']}': {e}")
-            logging.info(f"Variation JSON: {variations}")
+            logging.error(f"Error {doing_label} product batch starting at index {i}: {e}")
+    return written_products
 
 
-def update_products(wcapi, products):
-    for product in products:
+def create_simple_products(wcapi, products, batch_size=WC_BATCH_SIZE):
+    return write_products_batch(wcapi, 'create', products, batch_size)
+
+
+def write_variations_batch(wcapi, parent_id, create=(), update=(), delete=(), batch_size=WC_BATCH_SIZE):
+    """
+    Create, update and delete the variations of a product through
+    'products/{parent_id}/variations/batch', in as few requests as the batch
+    limit allows. Returns the number of variations written successfully.
+    """
+    operations = [('create', item) for item in create] + [('update', item) for item in update] + [('delete', item) for item in delete]
+    written = 0
+    for i in range(0, len(operations), batch_size):
+        data = {}
+        for action, item in operations[i:i + batch_size]:
+            data.setdefault(action, []).append(item)
         try:
-            product_id = product.pop('id')
-            response = wcapi.put(f"products/{product_id}", product)
+            request_data = {
+                action: items if action == 'delete' else [with_media_ids(item) for item in items]
+                for action, items in data.items()
+            }
+            response = wcapi.post(f"products/{parent_id}/variations/batch", request_data, idempotent='create' not in data)
             response_data = response.json()
-            if response.status_code in [200, 201]:
-                logging.info(f"Updated product '{product.get('name', '')}' with SKU '{product.get('sku', '')}'")
-            else:
+            if response.status_code not in [200, 201]:
                 error_message = response_data.get('message', 'Unknown error')
-                logging.error(f"Failed to update product ID '{product_id}': {error_message}")
-                logging.info(f"Product JSON: {product}")
+                logging.error(f"Failed to write variations of product ID {parent_id}: {error_message}")
+                continue
+
+            for action, items in data.items():
+                for item, result in zip(items, response_data.get(action, [])):
+                    label = item if action == 'delete' else item.get('sku', '')
+                    existing_id = get_existing_sku_id(result['error']) if action == 'create' and 'error' in result else None
+                    if existing_id:
+                        logging.info(f"Variation '{label}' of product ID {parent_id} already exists with ID {existing_id}")
+                        written += 1
+                        record_variation({"sku": label}, parent_id, existing_id)
+                    elif 'error' in result:
+                        error_message = result['error'].get('message', 'Unknown error')
+                        logging.error(f"Failed to {action} variation '{label}' of product ID {parent_id}: {error_message}")
+                        if action != 'delete' and is_invalid_image_error(result['error']):
+                            forget_media(item)
+                    else:
+                        logging.info(f"{BATCH_ACTION_LABELS[action][0]} variation '{label}' of product ID {parent_id}")
+                        written += 1
+                        if action == 'delete':
+                            forget_products([item])
+                        else:
+                            record_variation(item, parent_id, result['id'])
+                            index_written_media(item, result)
+        except CircuitOpenError:
+            raise
         except requests.exceptions.Timeout:
-            logging.error(f"Timeout occurred while updating product ID '{product_id}'")
+            logging.error(f"Timeout occurred while writing variations of product ID {parent_id}")
         except Exception as e:
-            logging.error(f"Error updating product ID '{product_id}': {e}")
-            logging.info(f"Product JSON: {product}")
+            logging.error(f"Error writing variations of product ID {parent_id}: {e}")
+    return written
+
+
+def create_variable_products(wcapi, products, batch_size=WC_BATCH_SIZE):
+    """
+    Create the parents and then their variations. Returns {parent_sku: parent_id}
+    of the products created completely, every variation included.
+    """
+    # Create the parent products in batches
+    created_parents = write_products_batch(wcapi, 'create', [item['parent'] for item in products], batch_size)
+
+    # Create the variations of each parent in a single request
+    created_products = {}
+    for item in products:
+        parent_sku = item['parent']['sku']
+        parent_id = created_parents.get(parent_sku)
+        if not parent_id:
+            continue  # No continuar con las variaciones si falla la creación del padre
+        written = write_variations_batch(wcapi, parent_id, create=item['variations'])
+        if written == len(item['variations']):
+            created_products[parent_sku] = parent_id
+    return created_products
+
+
+def update_products(wcapi, products, batch_size=WC_BATCH_SIZE):
+    return write_products_batch(wcapi, 'update', products, batch_size)
 
 def delete_products_batch(wcapi, product_ids, batch_size=20):
+    """
+    Delete products by ID in batches. Returns the IDs deleted successfully.
+    """
+    deleted_ids = []
     for i in range(0, len(product_ids), batch_size):
         batch_ids = product_ids[i:i + batch_size]
         data = {
             "delete": batch_ids
         }
         try:
-            response = wcapi.post("products/batch", data)
+            response = wcapi.post("products/batch", data, idempotent=True)
             response_data = response.json()
             if response.status_code in [200, 201]:
                 deleted_products = response_data.get('delete', [])
                 for product in deleted_products:
+                    if 'error' in product:
+                        logging.error(f"Failed deleting product ID '{product['id']}': {product['error'].get('message', 'Unknown error')}")
+                        continue
                     logging.info(f"Deleted product ID '{product['id']}'")
+                    deleted_ids.append(product['id'])
                 errors = response_data.get('errors', [])
                 for error in errors:
                     logging.error(f"Error deleting product: {error}")
             else:
                 error_message = response_data.get('message', 'Unknown error')
                 logging.error(f"Failed to delete product batch: {error_message}")
+        except CircuitOpenError:
+            forget_products(deleted_ids)
+            raise
         except requests.exceptions.Timeout:
             logging.error(f"Timeout occurred while deleting product batch starting at index {i}")
         except Exception as e:
             logging.error(f"Error deleting product batch starting at index {i}: {e}")
+    forget_products(deleted_ids)
+    return deleted_ids
 
 def get_variations_for_product(wcapi, parent_id):
     try:
-        variations = []
-        page = 1
-        while True:
-            response = wcapi.get(f"products/{parent_id}/variations", params={"per_page": 100, "page": page})
-            data = response.json()
-            if not data:
-                break
-            variations.extend(data)
-            page += 1
+        variations = get_all_pages(wcapi, f"products/{parent_id}/variations", params={"_fields": ",".join(VARIATION_SNAPSHOT_FIELDS)})
+        index_media(variation['image'] for variation in variations if variation.get('image'))
         return variations
+    except CircuitOpenError:
+        # Without its variations the product would look like it has none
+        raise
     except Exception as e:
         logging.error(f"Error fetching variations for product ID {parent_id}: {e}")
         return []
 
 
-def update_variable_products(wcapi, variable_products):
+def get_variations_for_products(wcapi, parent_ids):
+    """
+    Fetch the variations of many products concurrently. Returns {parent_id: variations}.
+    """
+    parent_ids = list(dict.fromkeys(parent_ids))
+    with ThreadPoolExecutor(max_workers=WC_MAX_WORKERS) as executor:
+        variations = executor.map(lambda parent_id: get_variations_for_product(wcapi, parent_id), parent_ids)
+        return dict(zip(parent_ids, variations))
+
+
+def update_variable_products(wcapi, variable_products, batch_size=WC_BATCH_SIZE):
+    """
+    Update the parents that changed and write the variations of each product.
+    Returns {parent_sku: parent_id} of the products written completely.
+    """
+    # Update the parent products that changed in batches
+    parents = [item['parent'] for item in variable_products if item['parent']]
+    updated_parents = write_products_batch(wcapi, 'update', parents, batch_size)
+
+    # Create, update and delete the variations of each parent in a single request
+    written_products = {}
     for item in variable_products:
-        parent_product = item['parent']
-        parent_id = item['parent_id']
-        variations_to_update = item['variations_to_update']
-        variations_to_create = item['variations_to_create']
-        variations_to_delete = item['variations_to_delete']
+        written = write_variations_batch(
+            wcapi,
+            item['parent_id'],
+            create=item['variations_to_create'],
+            update=item['variations_to_update'],
+            delete=item['variations_to_delete']
+        )
+        expected = len(item['variations_to_create']) + len(item['variations_to_update']) + len(item['variations_to_delete'])
+        parent_written = not item['parent'] or item['parent_sku'] in updated_parents
+        if parent_written and written == expected:
+            written_products[item['parent_sku']] = item['parent_id']
+    return written_products
 
-        try:
-            # Update parent product
-            response = wcapi.put(f"products/{parent_id}", parent_product).json()
-            logging.info(f"Updated variable product '{parent_product['name']}' with ID {parent_id}")
-
-            # Update existing variations
-            for variation in variations_to_update:
-                variation_id = variation.pop('id')
-                response = wcapi.put(f"products/{parent_id}/variations/{variation_id}", variation).json()
-                logging.info(f"Updated variation with SKU '{variation['sku']}' and ID {variation_id}")
-
-            # Create new variations
-            for variation in variations_to_create:
-                response = wcapi.post(f"products/{parent_id}/variations", variation).json()
-                logging.info(f"Created new variation with SKU '{variation['sku']}' for product ID {parent_id}")
-
-            # Delete variations not in Excel
-            for variation_id in variations_to_delete:
-                response = wcapi.delete(f"products/{parent_id}/variations/{variation_id}", params={"force": True}).json()
-                logging.info(f"Deleted variation ID {variation_id} from product ID {parent_id}")
 
-        except Exception as e:
-            logging.error(f"Error updating variable product ID {parent_id}: {e}")
+def _save_category_index(category_name_to_id, total, max_id):
+    save_json(CATEGORY_INDEX_PATH, {
+        "total": total,
+        "max_id": max_id,
+        "refreshed_at": time.time(),
+        "categories": category_name_to_id
+    })
+
+
+def get_categories_fingerprint(wcapi):
+    """
+    Return (total, highest ID) of the WooCommerce categories, from a single
+    one-item request. Adding or deleting a category changes it: a new one
+    always gets a higher ID.
+    """
+    response = wcapi.get("products/categories", params={"per_page": 1, "orderby": "id", "order": "desc", "_fields": "id"})
+    if response.status_code != 200:
+        raise Exception(f"Failed to fetch the categories fingerprint: {response.json().get('message', 'Unknown error')}")
+    categories = response.json()
+    return int(response.headers.get('X-WP-Total', -1)), categories[0]['id'] if categories else 0
 
 
 def get_all_woocommerce_categories(wcapi):
     try:
-        categories = []
-        page = 1
-        while True:
-            response = wcapi.get("products/categories", params={"per_page": 100, "page": page})
-            data = response.json()
-            if not data:
-                break
-            categories.extend(data)
-            page += 1
-        # Build a mapping from category name to ID
-        category_name_to_id = {cat['name']: cat['id'] for cat in categories}
+        # Reuse the saved index while the store has the same categories. Renames keep the
+        # fingerprint, but a renamed category still has its ID and the index expires anyway.
+        category_index = load_json(CATEGORY_INDEX_PATH, {})
+        total, max_id = get_categories_fingerprint(wcapi)
+        index_age = time.time() - category_index.get('refreshed_at', 0)
+        if (category_index.get('total'), category_index.get('max_id')) == (total, max_id) and index_age < CATEGORY_INDEX_TTL_HOURS * 3600:
+            logging.info(f"Using the saved index of {total} WooCommerce categories.")
+            record_cache('category_index', hits=1)
+            return category_index['categories']
+
+        record_cache('category_index', misses=1)
+
+        categories = get_all_pages(wcapi, "products/categories", params={"_fields": "id,name"})
+        # Build a mapping from category name to ID (WooCommerce escapes HTML in names)
+        category_name_to_id = {html.unescape(cat['name']): cat['id'] for cat in categories}
+        _save_category_index(category_name_to_id, len(categories), max((cat['id'] for cat in categories), default=0))
         logging.info("Fetched all categories from WooCommerce.")
         return category_name_to_id
     except Exception as e:
@@ -191,27 +381,80 @@ def get_all_woocommerce_categories(wcapi):
         raise
 
 
-def create_missing_categories(wcapi, category_names, existing_categories):
+def create_categories_batch(wcapi, categories, existing_categories, batch_size=WC_BATCH_SIZE):
+    """
+    Create categories through 'products/categories/batch' and add their IDs to
+    existing_categories. Returns the number of categories created.
+    """
+    created = 0
+    for i in range(0, len(categories), batch_size):
+        batch = categories[i:i + batch_size]
+        try:
+            # Resending is safe: existing categories come back as 'term_exists' with their ID
+            response = wcapi.post("products/categories/batch", {"create": batch}, idempotent=True)
+            response_data = response.json()
+            if response.status_code not in [200, 201]:
+                error_message = response_data.get('message', 'Unknown error')
+                logging.error(f"Failed to create category batch starting at index {i}: {error_message}")
+                continue
+
+            for category, result in zip(batch, response_data.get('create', [])):
+                category_name = category['name']
+                error = result.get('error')
+                if not error:
+                    existing_categories[category_name] = result['id']
+                    created += 1
+                    logging.info(f"Created new category '{category_name}' with ID {result['id']}")
+                elif error.get('code') == 'term_exists':
+                    # Created meanwhile or not in the saved index, WooCommerce tells its ID
+                    existing_categories[category_name] = error['data']['resource_id']
+                    logging.info(f"Category '{category_name}' already exists with ID {error['data']['resource_id']}")
+                else:
+                    logging.error(f"Failed to create category '{category_name}': {error.get('message', 'Unknown error')}")
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logging.error(f"Error creating category batch starting at index {i}: {e}")
+    return created
+
 
-    # Get existing categories from existing_categories dict (keys)
-    existing_categorie_names = existing_categories.keys()
+def create_missing_categories(wcapi, category_names, existing_categories, category_parents=None):
+    """
+    Create the categories not in WooCommerce yet, in batches, parents before
+    their children so each child is linked to its parent ID.
+    """
+    category_parents = category_parents or {}
 
     # Get missing categories in category_names list
-    missing_categories = list(set(category_names) - set(existing_categorie_names))
+    missing_categories = set(category_names) - set(existing_categories.keys())
+    if not missing_categories:
+        return existing_categories
 
-    # Create missing categories
-    for category_name in missing_categories:
-        try:
+    created = 0
+    while missing_categories:
+        # Categories whose parent already exists (or that have none) can be created now
+        ready = sorted(
+            name for name in missing_categories
+            if category_parents.get(name) not in missing_categories
+        )
+        if not ready:
+            # Cyclic parents, create the rest without parent
+            ready = sorted(missing_categories)
+
+        batch = []
+        for category_name in ready:
             data = {"name": category_name}
-            response = wcapi.post("products/categories", data).json()
-            category_id = response.get('id')
-            if category_id:
-                existing_categories[category_name] = category_id
-                logging.info(f"Created new category '{category_name}' with ID {category_id}")
-            else:
-                logging.error(f"Failed to create category '{category_name}': {response}")
-        except Exception as e:
-            logging.error(f"Error creating category '{category_name}': {e}")
+            parent_id = existing_categories.get(category_parents.get(category_name))
+            if parent_id:
+                data["parent"] = parent_id
+            batch.append(data)
+
+        created += create_categories_batch(wcapi, batch, existing_categories)
+        missing_categories -= set(ready)
 
+    # Keep the saved index up to date with the new categories, the newest of which has the highest ID
+    category_index = load_json(CATEGORY_INDEX_PATH, {})
+    max_id = max([category_index.get('max_id', 0), *existing_categories.values()])
+    _save_category_index(existing_categories, category_index.get('total', 0) + created, max_id)
 
-    return existing_categories
\ No newline at end of file
+    return existing_categories